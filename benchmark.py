@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import platform
+import contextlib
+from rulebuilder import IntegerType, CategoricalType, RuleBuilder, StatisticalCriterion, Instrumentation
+from datacache import load_data_set
+from main import create_domain
+
+INTEGER_RANGES = [(4, 72), (250, 18424), (1, 4), (1, 4), (19, 75), (1, 4), (1, 2)]
+
+
+def generate_records(domain, rows, seed=0):
+    rnd = random.Random(seed)
+    ranges = iter(INTEGER_RANGES)
+    columns = []
+    for type_ in domain.get_item_types():
+        if isinstance(type_, CategoricalType):
+            columns.append(sorted(type_.get_categories()))
+        elif isinstance(type_, IntegerType):
+            columns.append(next(ranges, (0, 100)))
+        else:
+            raise TypeError("Unsupported item type")
+    for _ in xrange(rows):
+        record = []
+        for column in columns:
+            if isinstance(column, tuple):
+                record.append(str(rnd.randint(*column)))
+            else:
+                record.append(rnd.choice(column))
+        risk = (record[0] == "A11") + (int(record[1]) > 36) + (record[2] in ("A30", "A31"))
+        record.append("2" if rnd.random() < 0.15 + 0.2 * risk else "1")
+        yield record
+
+
+def write_records(path, records):
+    with contextlib.closing(open(path, "w")) as f:
+        for record in records:
+            f.write(" ".join(record) + "\n")
+
+
+def run(rows, seed=0, population=10, max_rank=4):
+    domain = create_domain()
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, "data.txt")
+        write_records(path, generate_records(domain, rows, seed))
+        instrumentation = Instrumentation()
+        start = time.time()
+        load_data_set(path, domain)
+        instrumentation.on_stage("load", time.time() - start)
+        start = time.time()
+        data_set = load_data_set(path, domain)
+        instrumentation.on_stage("load_cached", time.time() - start)
+    finally:
+        shutil.rmtree(directory)
+
+    start = time.time()
+    rule_builder = RuleBuilder(data_set, seed=seed, observer=instrumentation)
+    rules = rule_builder.build_rules(1, population=population, criterion=StatisticalCriterion(), max_rank=max_rank)
+    stages = instrumentation.get_timers()
+    return {"rows": rows,
+            "rules": len(rules),
+            "total": time.time() - start + stages["load"],
+            "stages": stages,
+            "counters": instrumentation.get_counters()}
+
+
+def compare(results, baseline, threshold, min_seconds=0.01):
+    regressions = []
+    for size, result in sorted(results.items()):
+        if size not in baseline:
+            continue
+        old_stages = dict(baseline[size]["stages"], total=baseline[size]["total"])
+        new_stages = dict(result["stages"], total=result["total"])
+        for stage, old in sorted(old_stages.items()):
+            new = new_stages.get(stage)
+            if new is None or old < min_seconds:
+                continue
+            if new > old * (1.0 + threshold):
+                regressions.append((size, stage, old, new))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the rule-mining pipeline on synthetic data.")
+    parser.add_argument("--sizes", default="1000,10000", help="comma-separated row counts")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--population", type=int, default=10)
+    parser.add_argument("--max-rank", type=int, default=4)
+    parser.add_argument("--output", default="benchmark.json")
+    parser.add_argument("--baseline", help="previous output to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed relative slowdown per stage")
+    args = parser.parse_args(argv)
+
+    results = {}
+    for rows in [int(size) for size in args.sizes.split(",")]:
+        result = run(rows, args.seed, args.population, args.max_rank)
+        results[str(rows)] = result
+        sys.stdout.write("{0} rows: {1:.3f}s\n".format(rows, result["total"]))
+        for stage, seconds in sorted(result["stages"].items()):
+            sys.stdout.write("  {0:<20} {1:.4f}s\n".format(stage, seconds))
+
+    with contextlib.closing(open(args.output, "w")) as f:
+        json.dump({"python": platform.python_version(), "seed": args.seed, "results": results},
+                  f, indent=2, sort_keys=True)
+
+    if args.baseline is None:
+        return 0
+    with contextlib.closing(open(args.baseline)) as f:
+        baseline = json.load(f)["results"]
+    regressions = compare(results, baseline, args.threshold)
+    for size, stage, old, new in regressions:
+        sys.stdout.write("REGRESSION {0} rows {1}: {2:.4f}s -> {3:.4f}s\n".format(size, stage, old, new))
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
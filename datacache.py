@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import os
+import sys
+import json
+import hashlib
+import contextlib
+from array import array
+from rulebuilder import IntegerType, FloatType, CategoricalType, ColumnarDataSet, read_data_set
+
+CACHE_VERSION = 1
+HEADER_NAME = "header.json"
+
+
+def _type_schema(type_):
+    if isinstance(type_, CategoricalType):
+        return ["categorical"] + sorted(type_.get_categories())
+    if isinstance(type_, FloatType):
+        return ["float"]
+    if isinstance(type_, IntegerType):
+        return ["integer"]
+    raise TypeError("Unsupported item type")
+
+
+def domain_schema(domain):
+    return {"items": [_type_schema(type_) for type_ in domain.get_item_types()],
+            "class": _type_schema(domain.get_class_type()) if domain.has_class() else None}
+
+
+def _decode_label(type_, label):
+    if label is None:
+        return None
+    if isinstance(type_, CategoricalType):
+        return dict((category, category) for category in type_.get_categories())[label]
+    return type_.cast(label)
+
+
+def _source_stat(path):
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime
+
+
+def _hashing_lines(f, digest):
+    for line in f:
+        digest.update(line)
+        yield line
+
+
+def _file_digest(path):
+    digest = hashlib.sha1()
+    with contextlib.closing(open(path, "rb")) as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _read_header(cache_path):
+    try:
+        with contextlib.closing(open(os.path.join(cache_path, HEADER_NAME))) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return None
+
+
+def _write_header(cache_path, header):
+    temp_path = os.path.join(cache_path, HEADER_NAME + ".tmp")
+    with contextlib.closing(open(temp_path, "w")) as f:
+        json.dump(header, f)
+    os.rename(temp_path, os.path.join(cache_path, HEADER_NAME))
+
+
+def _read_column(path, typecode, rows):
+    column = array(typecode)
+    with contextlib.closing(open(path, "rb")) as f:
+        try:
+            column.fromfile(f, rows)
+        except EOFError:
+            raise ValueError("Corrupted cache column")
+        if f.read(1):
+            raise ValueError("Corrupted cache column")
+    return column
+
+
+def write_cache(data_set, cache_path, source=None):
+    if not os.path.isdir(cache_path):
+        os.makedirs(cache_path)
+    header_path = os.path.join(cache_path, HEADER_NAME)
+    if os.path.exists(header_path):
+        os.remove(header_path)
+    domain = data_set.get_domain()
+    columns = []
+    for index in range(len(domain.get_item_types())):
+        name = "column_{0:03d}.bin".format(index)
+        codes = data_set.get_codes(index)
+        with contextlib.closing(open(os.path.join(cache_path, name), "wb")) as f:
+            codes.tofile(f)
+        columns.append({"file": name, "typecode": codes.typecode})
+    class_codes = data_set.get_class_codes()
+    with contextlib.closing(open(os.path.join(cache_path, "classes.bin"), "wb")) as f:
+        class_codes.tofile(f)
+    _write_header(cache_path, {"version": CACHE_VERSION,
+                               "byteorder": sys.byteorder,
+                               "source": source,
+                               "domain": domain_schema(domain),
+                               "rows": len(data_set),
+                               "labels": data_set.get_labels(),
+                               "columns": columns,
+                               "classes": {"file": "classes.bin", "typecode": class_codes.typecode}})
+
+
+def read_cache(cache_path, domain, header=None):
+    if header is None:
+        header = _read_header(cache_path)
+    if header is None or header.get("version") != CACHE_VERSION or header.get("byteorder") != sys.byteorder:
+        return None
+    if header.get("domain") != domain_schema(domain):
+        return None
+    rows = header["rows"]
+    try:
+        columns = [_read_column(os.path.join(cache_path, column["file"]), str(column["typecode"]), rows)
+                   for column in header["columns"]]
+        classes = header["classes"]
+        class_codes = _read_column(os.path.join(cache_path, classes["file"]), str(classes["typecode"]), rows)
+        labels = [_decode_label(domain.get_class_type(), label) for label in header["labels"]]
+        data_set = ColumnarDataSet(domain)
+        data_set.load_columns(columns, labels, class_codes)
+    except (IOError, ValueError, KeyError, TypeError):
+        return None
+    return data_set
+
+
+def load_data_set(path, domain, cache_path=None, chunk_size=65536, progress=None):
+    if cache_path is None:
+        cache_path = path + ".cache"
+    size, mtime = _source_stat(path)
+    header = _read_header(cache_path)
+    if header is not None and header.get("source") is not None:
+        source = header["source"]
+        if source["size"] != size or source["mtime"] != mtime:
+            if source["size"] == size and source["sha1"] == _file_digest(path):
+                header["source"] = dict(source, mtime=mtime)
+                _write_header(cache_path, header)
+            else:
+                header = None
+        if header is not None:
+            data_set = read_cache(cache_path, domain, header)
+            if data_set is not None:
+                return data_set
+
+    digest = hashlib.sha1()
+    with contextlib.closing(open(path, "rb")) as f:
+        data_set = read_data_set(_hashing_lines(f, digest), domain, chunk_size, progress)
+    write_cache(data_set, cache_path, {"size": size, "mtime": mtime, "sha1": digest.hexdigest()})
+    return data_set
@@ -1,11 +1,19 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 class ListNode(object):
+    __slots__ = ("value", "_next", "_prev")
+
     def __init__(self, value, prev=None, next=None):
         self.value = value
         self._next = next
         self._prev = prev
 
+    def __getstate__(self):
+        return self.value, self._prev, self._next
+
+    def __setstate__(self, state):
+        self.value, self._prev, self._next = state
+
 
 class LinkedList(object):
     def __init__(self):
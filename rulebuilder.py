@@ -1,12 +1,63 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
+import os
 import operator
 import math
 import random
-from linkedlist import LinkedList
+import time
+import multiprocessing
+import weakref
+import json
+import cPickle as pickle
+from itertools import islice, izip
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict
 from copy import copy
 
 
+def _make_mask(flags):
+    bits = "".join(["1" if flag else "0" for flag in flags])
+    if not bits:
+        return 0
+    return int(bits[::-1], 2)
+
+
+def _popcount(mask):
+    return bin(mask).count("1")
+
+
+def set_bits(mask):
+    bits = bin(mask)[:1:-1]
+    row = bits.find("1")
+    while row >= 0:
+        yield row
+        row = bits.find("1", row + 1)
+
+
+def _slot_names(cls):
+    names = []
+    for klass in cls.__mro__:
+        for name in klass.__dict__.get("__slots__", ()):
+            if name == "__weakref__":
+                continue
+            if name.startswith("__") and not name.endswith("__"):
+                name = "_{0}{1}".format(klass.__name__.lstrip("_"), name)
+            names.append(name)
+    return names
+
+
+class _SlotsState(object):
+    __slots__ = ()
+
+    def __getstate__(self):
+        return dict((name, getattr(self, name)) for name in _slot_names(type(self)) if hasattr(self, name))
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
+
+
 class BoolCmp(object):
     def __init__(self, precision):
         self.precision = precision
@@ -23,23 +74,35 @@ class IntegerType(object):
     def cast(self, item):
         return int(item)
 
+    def cast_column(self, items):
+        return map(int, items)
+
     def __eq__(self, other):
         return isinstance(other, IntegerType)
 
     def __ne__(self, other):
         return not isinstance(other, IntegerType)
 
+    def get_key(self):
+        return ("integer",)
+
 
 class FloatType(object):
     def cast(self, item):
         return float(item)
 
+    def cast_column(self, items):
+        return map(float, items)
+
     def __eq__(self, other):
         return isinstance(other, FloatType)
 
     def __ne__(self, other):
         return not isinstance(other, FloatType)
 
+    def get_key(self):
+        return ("float",)
+
 
 class CategoricalType(object):
     def __init__(self, *categories):
@@ -55,15 +118,43 @@ class CategoricalType(object):
             raise TypeError("Wrong item category")
         return item
 
+    def cast_column(self, items):
+        if not self.__categories.issuperset(items):
+            raise TypeError("Wrong item category")
+        return list(items)
+
     def __eq__(self, other):
         return isinstance(other, CategoricalType)
 
     def __ne__(self, other):
         return not isinstance(other, CategoricalType)
 
+    def get_key(self):
+        return ("categorical", frozenset(self.__categories))
+
 
 class Domain(object):
+    __slots__ = ("__has_class", "__item_types", "__class_type", "__weakref__")
+    __interned = weakref.WeakValueDictionary()
+
+    def __new__(cls, categories, has_class=True):
+        key = (cls, tuple(Domain.__type_key(type_) for type_ in categories), has_class)
+        domain = Domain.__interned.get(key)
+        if domain is None:
+            domain = super(Domain, cls).__new__(cls)
+            Domain.__interned[key] = domain
+        return domain
+
+    @staticmethod
+    def __type_key(type_):
+        if hasattr(type_, "get_key"):
+            return type_.get_key()
+        # types without a key are only shared by identity
+        return ("object", id(type_))
+
     def __init__(self, categories, has_class=True):
+        if hasattr(self, "_Domain__has_class"):
+            return
         self.__has_class = has_class
         if not has_class:
             self.__item_types = tuple(categories)
@@ -81,16 +172,24 @@ class Domain(object):
     def get_item_types(self):
         return self.__item_types
 
+    def __reduce__(self):
+        if self.__has_class:
+            return Domain, (self.__item_types + (self.__class_type,), True)
+        return Domain, (self.__item_types, False)
+
     def __eq__(self, other):
-        if self.__class_type != other.__class_type:
-            return False
-        for item1, item2 in zip(self.__item_types, other.__item_types):
-            if item1 != item2:
-                return False
-        return True
+        return self is other
+
+    def __ne__(self, other):
+        return self is not other
+
+    def __hash__(self):
+        return id(self)
 
 
-class DataEntry(object):
+class DataEntry(_SlotsState):
+    __slots__ = ("__domain", "__items", "__class")
+
     def __init__(self, domain, data):
         self.__domain = domain
         self.__items = []
@@ -117,8 +216,8 @@ class DataSet(object):
         self.__domain = domain
         self.__entries = []
 
-    def append(self, entry):
-        if entry.get_domain() != self.__domain:
+    def append(self, entry, validate=True):
+        if validate and entry.get_domain() is not self.__domain:
             raise TypeError("Wrong domain")
         self.__entries.append(entry)
 
@@ -144,7 +243,7 @@ class DataSet(object):
         return self.__entries[index]
 
     def __setitem__(self, index, entry):
-        if entry.get_domain() != self.__domain:
+        if entry.get_domain() is not self.__domain:
             raise TypeError("Wrong domain")
         self.__entries[index] = entry
 
@@ -158,19 +257,337 @@ class DataSet(object):
         for entry in self.__entries:
             yield entry
 
+    def get_column(self, index):
+        return [entry.get_items()[index] for entry in self.__entries]
+
+    def get_classes(self):
+        return [entry.get_class() for entry in self.__entries]
+
+
+class RowItems(object):
+    __slots__ = ("__data_set", "__row")
+
+    def __init__(self, data_set, row):
+        self.__data_set = data_set
+        self.__row = row
+
+    __hash__ = None
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return list(self)[index]
+        return self.__data_set.get_item(self.__row, index)
+
+    def __len__(self):
+        return len(self.__data_set.get_domain().get_item_types())
+
+    def __iter__(self):
+        for index in xrange(len(self)):
+            yield self.__data_set.get_item(self.__row, index)
+
+    def __eq__(self, other):
+        if isinstance(other, RowItems):
+            other = list(other)
+        return list(self) == other
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __add__(self, other):
+        if isinstance(other, RowItems):
+            other = list(other)
+        return list(self) + other
+
+    def __radd__(self, other):
+        return other + list(self)
+
+    def __repr__(self):
+        return repr(list(self))
+
+
+class DataRow(object):
+    __slots__ = ("__data_set", "__row")
+
+    def __init__(self, data_set, row):
+        self.__data_set = data_set
+        self.__row = row
+
+    def get_items(self):
+        return RowItems(self.__data_set, self.__row)
+
+    def get_class(self):
+        return self.__data_set.get_row_class(self.__row)
+
+    def get_domain(self):
+        return self.__data_set.get_domain()
+
+
+def _code_typecode(size):
+    if size <= 0x100:
+        return "B"
+    if size <= 0x10000:
+        return "H"
+    return "l"
+
+
+class ColumnarDataSet(object):
+    def __init__(self, domain):
+        self.__domain = domain
+        self.__columns = []
+        self.__categories = []
+        self.__category_codes = []
+        for type_ in domain.get_item_types():
+            if isinstance(type_, CategoricalType):
+                categories = tuple(sorted(type_.get_categories()))
+                self.__columns.append(array(_code_typecode(len(categories))))
+                self.__categories.append(categories)
+                self.__category_codes.append(dict((category, code) for code, category in enumerate(categories)))
+            else:
+                self.__columns.append(array("d" if isinstance(type_, FloatType) else "l"))
+                self.__categories.append(None)
+                self.__category_codes.append(None)
+        self.__labels = []
+        self.__label_codes = {}
+        self.__classes = array("H")
+
+    def __encode_item(self, index, item):
+        codes = self.__category_codes[index]
+        if codes is None:
+            return item
+        if item not in codes:
+            raise TypeError("Wrong item category")
+        return codes[item]
+
+    def __encode_class(self, class_):
+        if class_ not in self.__label_codes:
+            self.__label_codes[class_] = len(self.__labels)
+            self.__labels.append(class_)
+        return self.__label_codes[class_]
+
+    def __append_items(self, items, class_):
+        codes = [self.__encode_item(index, item) for index, item in enumerate(items)]
+        class_code = self.__encode_class(class_)
+        for column, code in zip(self.__columns, codes):
+            column.append(code)
+        self.__classes.append(class_code)
+
+    def __cast_raw(self, raw_entry):
+        types = self.__domain.get_item_types()
+        items = [type_.cast(item) for type_, item in zip(types, raw_entry)]
+        if not self.__domain.has_class():
+            return items, None
+        return items, self.__domain.get_class_type().cast(raw_entry[len(types)])
+
+    def append(self, entry, validate=True):
+        if validate and entry.get_domain() is not self.__domain:
+            raise TypeError("Wrong domain")
+        self.__append_items(entry.get_items(), entry.get_class())
+
+    def append_raw(self, raw_entry):
+        self.__append_items(*self.__cast_raw(raw_entry))
+
+    def extend(self, entries):
+        for entry in entries:
+            self.append(entry)
+
+    def __extend_raw_chunk(self, chunk):
+        types = self.__domain.get_item_types()
+        columns = zip(*chunk)
+        width = len(types) + 1 if self.__domain.has_class() else len(types)
+        if len(columns) < width:
+            raise ValueError("Wrong number of items")
+        encoded = []
+        for index, (type_, column) in enumerate(zip(types, columns)):
+            items = type_.cast_column(column)
+            codes = self.__category_codes[index]
+            encoded.append(items if codes is None else map(codes.__getitem__, items))
+        if self.__domain.has_class():
+            classes = self.__domain.get_class_type().cast_column(columns[len(types)])
+        else:
+            classes = [None] * len(chunk)
+        for column, items in zip(self.__columns, encoded):
+            column.extend(items)
+        self.__classes.extend(map(self.__encode_class, classes))
+
+    def extend_raw(self, raw_entries, chunk_size=65536, progress=None):
+        raw_entries = iter(raw_entries)
+        rows = 0
+        start = time.time()
+        while True:
+            chunk = list(islice(raw_entries, chunk_size))
+            if not chunk:
+                break
+            self.__extend_raw_chunk(chunk)
+            rows += len(chunk)
+            if progress is not None:
+                progress(rows, time.time() - start)
+
+    def get_entries(self):
+        return [DataRow(self, row) for row in xrange(len(self))]
+
+    def get_domain(self):
+        return self.__domain
+
+    def get_item(self, row, index):
+        categories = self.__categories[index]
+        if categories is None:
+            return self.__columns[index][row]
+        return categories[self.__columns[index][row]]
+
+    def get_row_class(self, row):
+        return self.__labels[self.__classes[row]]
+
+    def get_column(self, index):
+        categories = self.__categories[index]
+        if categories is None:
+            return self.__columns[index]
+        return map(categories.__getitem__, self.__columns[index])
+
+    def get_codes(self, index):
+        return self.__columns[index]
+
+    def get_categories(self, index):
+        return self.__categories[index]
+
+    def get_classes(self):
+        return map(self.__labels.__getitem__, self.__classes)
+
+    def get_class_codes(self):
+        return self.__classes
+
+    def get_labels(self):
+        return list(self.__labels)
+
+    def load_columns(self, columns, labels, class_codes):
+        if len(columns) != len(self.__columns):
+            raise ValueError("Wrong number of columns")
+        for column, categories in zip(columns, self.__categories):
+            if len(column) != len(class_codes):
+                raise ValueError("Columns have different lengths")
+            if categories is not None and column and max(column) >= len(categories):
+                raise TypeError("Wrong item category")
+        if class_codes and max(class_codes) >= len(labels):
+            raise ValueError("Wrong class code")
+        self.__columns = list(columns)
+        self.__labels = list(labels)
+        self.__label_codes = dict((label, code) for code, label in enumerate(self.__labels))
+        self.__classes = class_codes
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [DataRow(self, row) for row in xrange(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("list index out of range")
+        return DataRow(self, index)
+
+    def __setitem__(self, index, entry):
+        if entry.get_domain() is not self.__domain:
+            raise TypeError("Wrong domain")
+        codes = [self.__encode_item(i, item) for i, item in enumerate(entry.get_items())]
+        class_code = self.__encode_class(entry.get_class())
+        for column, code in zip(self.__columns, codes):
+            column[index] = code
+        self.__classes[index] = class_code
+
+    def __delitem__(self, index):
+        for column in self.__columns:
+            del column[index]
+        del self.__classes[index]
+
+    def __len__(self):
+        return len(self.__classes)
+
+    def __iter__(self):
+        for row in xrange(len(self)):
+            yield DataRow(self, row)
+
+
+class DataSetView(object):
+    def __init__(self, parent, indices):
+        self.__parent = parent
+        self.__indices = indices
+
+    def get_parent(self):
+        return self.__parent
+
+    def get_indices(self):
+        return self.__indices
+
+    def get_entries(self):
+        return [self.__parent[row] for row in self.__indices]
+
+    def get_domain(self):
+        return self.__parent.get_domain()
+
+    def get_column(self, index):
+        column = self.__parent.get_column(index)
+        return [column[row] for row in self.__indices]
+
+    def get_classes(self):
+        classes = self.__parent.get_classes()
+        return [classes[row] for row in self.__indices]
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.__parent[row] for row in self.__indices[index]]
+        return self.__parent[self.__indices[index]]
+
+    def __len__(self):
+        return len(self.__indices)
+
+    def __iter__(self):
+        for row in self.__indices:
+            yield self.__parent[row]
+
+
+def stratified_split(classes, test_fraction, rnd=random):
+    buckets = {}
+    for row, class_ in enumerate(classes):
+        buckets.setdefault(class_, array("l")).append(row)
+    train_rows = array("l")
+    test_rows = array("l")
+    for rows in buckets.values():
+        test_number = int(len(rows) * test_fraction)
+        if test_number == 0 and len(rows) > 1:
+            test_number = 1
+        for i in range(test_number):
+            j = rnd.randint(i + 1, len(rows) - 1)
+            rows[i], rows[j] = rows[j], rows[i]
+        test_rows.extend(rows[:test_number])
+        train_rows.extend(rows[test_number:])
+    return train_rows, test_rows
+
+
+def read_data_set(lines, domain, chunk_size=65536, progress=None):
+    data_set = ColumnarDataSet(domain)
+    data_set.extend_raw((line.split() for line in lines), chunk_size, progress)
+    return data_set
+
+
+class AbstractRule(_SlotsState):
+    __slots__ = ("__domain",)
 
-class AbstractRule(object):
     def __init__(self, domain):
         self.__domain = domain
 
     def _apply_customized(self, entry):
         pass
 
-    def apply(self, entry):
-        if entry.get_domain() != self.__domain:
+    def apply(self, entry, validate=True):
+        if validate and entry.get_domain() is not self.__domain:
             raise TypeError("Wrong domain")
         return self._apply_customized(entry)
 
+    def _apply_batch_customized(self, data_set):
+        return _make_mask(self._apply_customized(entry) for entry in data_set)
+
+    def apply_batch(self, data_set, validate=True):
+        if validate and data_set.get_domain() is not self.__domain:
+            raise TypeError("Wrong domain")
+        return self._apply_batch_customized(data_set)
+
     def get_domain(self):
         return self.__domain
 
@@ -180,14 +597,26 @@ class AbstractRule(object):
 
 
 class EquivalenceRule(AbstractRule):
+    __slots__ = ("__index", "__value")
+
     def __init__(self, domain, index, value):
         super(EquivalenceRule, self).__init__(domain)
         self.__index = index
         self.__value = domain.get_item_types()[index].cast(value)
 
+    def get_index(self):
+        return self.__index
+
+    def get_value(self):
+        return self.__value
+
     def _apply_customized(self, entry):
         return entry.get_items()[self.__index] == self.__value
 
+    def _apply_batch_customized(self, data_set):
+        value = self.__value
+        return _make_mask([item == value for item in data_set.get_column(self.__index)])
+
     @staticmethod
     def is_applicable(item_type):
         return True
@@ -201,6 +630,8 @@ class EquivalenceRule(AbstractRule):
 
 
 class SetRule(AbstractRule):
+    __slots__ = ("__index", "__set")
+
     def __init__(self, domain, index, iterable):
         super(SetRule, self).__init__(domain)
         self.__index = index
@@ -208,9 +639,19 @@ class SetRule(AbstractRule):
         for item in iterable:
             self.__set.add(domain.get_item_types()[index].cast(item))
 
+    def get_index(self):
+        return self.__index
+
+    def get_values(self):
+        return self.__set
+
     def _apply_customized(self, entry):
         return entry.get_items()[self.__index] in self.__set
 
+    def _apply_batch_customized(self, data_set):
+        values = self.__set
+        return _make_mask([item in values for item in data_set.get_column(self.__index)])
+
     @staticmethod
     def is_applicable(item_type):
         return True
@@ -224,14 +665,26 @@ class SetRule(AbstractRule):
 
 
 class LERule(AbstractRule):
+    __slots__ = ("__index", "__threshold")
+
     def __init__(self, domain, index, threshold):
         super(LERule, self).__init__(domain)
         self.__index = index
         self.__threshold = threshold
 
+    def get_index(self):
+        return self.__index
+
+    def get_threshold(self):
+        return self.__threshold
+
     def _apply_customized(self, entry):
         return entry.get_items()[self.__index] <= self.__threshold
 
+    def _apply_batch_customized(self, data_set):
+        threshold = self.__threshold
+        return _make_mask([item <= threshold for item in data_set.get_column(self.__index)])
+
     @staticmethod
     def is_applicable(item_type):
         return issubclass(item_type, IntegerType) or issubclass(item_type, FloatType)
@@ -245,14 +698,26 @@ class LERule(AbstractRule):
 
 
 class GERule(AbstractRule):
+    __slots__ = ("__index", "__threshold")
+
     def __init__(self, domain, index, threshold):
         super(GERule, self).__init__(domain)
         self.__index = index
         self.__threshold = threshold
 
+    def get_index(self):
+        return self.__index
+
+    def get_threshold(self):
+        return self.__threshold
+
     def _apply_customized(self, entry):
         return entry.get_items()[self.__index] >= self.__threshold
 
+    def _apply_batch_customized(self, data_set):
+        threshold = self.__threshold
+        return _make_mask([item >= threshold for item in data_set.get_column(self.__index)])
+
     @staticmethod
     def is_applicable(item_type):
         return issubclass(item_type, IntegerType) or issubclass(item_type, FloatType)
@@ -266,15 +731,30 @@ class GERule(AbstractRule):
 
 
 class RangeRule(AbstractRule):
+    __slots__ = ("__index", "__left", "__right")
+
     def __init__(self, domain, index, left, right):
         super(RangeRule, self).__init__(domain)
         self.__index = index
         self.__left = left
         self.__right = right
 
+    def get_index(self):
+        return self.__index
+
+    def get_left(self):
+        return self.__left
+
+    def get_right(self):
+        return self.__right
+
     def _apply_customized(self, entry):
         return entry.get_items()[self.__index] >= self.__left and entry.get_items()[self.__index] <= self.__right
 
+    def _apply_batch_customized(self, data_set):
+        left, right = self.__left, self.__right
+        return _make_mask([left <= item <= right for item in data_set.get_column(self.__index)])
+
     @staticmethod
     def is_applicable(item_type):
         return issubclass(item_type, IntegerType) or issubclass(item_type, FloatType)
@@ -287,26 +767,115 @@ class RangeRule(AbstractRule):
         return "{0}:{1}:{{{2},{3}}}".format(self.get_type(), self.__index + 1, self.__left, self.__right)
 
 
+def _estimate_selectivity(domain, rule):
+    if isinstance(rule, (EquivalenceRule, SetRule)):
+        item_type = domain.get_item_types()[rule.get_index()]
+        if not isinstance(item_type, CategoricalType):
+            return 0.1 if isinstance(rule, EquivalenceRule) else 0.5
+        size = 1 if isinstance(rule, EquivalenceRule) else len(rule.get_values())
+        return min(1.0, float(size) / len(item_type.get_categories()))
+    if isinstance(rule, RangeRule):
+        return 0.25
+    return 0.5
+
+
+def _compile_predicate(domain, rules, selectivity=None):
+    checks = []
+    intervals = {}
+    for rule in rules:
+        if selectivity is not None and rule in selectivity:
+            fraction = selectivity[rule]
+        else:
+            fraction = _estimate_selectivity(domain, rule)
+        if isinstance(rule, (LERule, GERule, RangeRule)):
+            if isinstance(rule, LERule):
+                left, right = None, rule.get_threshold()
+            elif isinstance(rule, GERule):
+                left, right = rule.get_threshold(), None
+            else:
+                left, right = rule.get_left(), rule.get_right()
+            interval = intervals.setdefault(rule.get_index(), [None, None, 1.0])
+            if left is not None and (interval[0] is None or left > interval[0]):
+                interval[0] = left
+            if right is not None and (interval[1] is None or right < interval[1]):
+                interval[1] = right
+            interval[2] = min(interval[2], fraction)
+        elif isinstance(rule, EquivalenceRule):
+            checks.append((1, fraction, "items[{0}] == {{0}}".format(rule.get_index()), rule.get_value()))
+        elif isinstance(rule, SetRule):
+            checks.append((1, fraction, "items[{0}] in {{0}}".format(rule.get_index()), frozenset(rule.get_values())))
+        else:
+            checks.append((4, fraction, "{0}.apply(entry, False)", rule))
+    for index, (left, right, fraction) in intervals.items():
+        if left is not None and right is not None:
+            if left > right:
+                return lambda entry: False
+            checks.append((2, fraction, "{{0}} <= items[{0}] <= {{1}}".format(index), left, right))
+        elif left is not None:
+            checks.append((1, fraction, "items[{0}] >= {{0}}".format(index), left))
+        else:
+            checks.append((1, fraction, "items[{0}] <= {{0}}".format(index), right))
+    if not checks:
+        return lambda entry: True
+
+    checks.sort(key=lambda check: check[0] / (1.0 - check[1]) if check[1] < 1.0 else float("inf"))
+    namespace = {}
+    terms = []
+    for check in checks:
+        names = []
+        for constant in check[3:]:
+            names.append("c{0}".format(len(namespace)))
+            namespace[names[-1]] = constant
+        terms.append(check[2].format(*names))
+    source = "def predicate(entry):\n    items = entry.get_items()\n    return {0}\n".format(" and ".join(terms))
+    exec source in namespace
+    return namespace["predicate"]
+
+
 class Conjunction(AbstractRule):
+    __slots__ = ("__rules", "__predicate")
+
     def __init__(self, domain, rules = ()):
         super(Conjunction, self).__init__(domain)
         self.__rules = set()
+        self.__predicate = None
         self.extend(rules)
 
     def add(self, rule):
         self.__rules.add(rule)
+        self.__predicate = None
 
     def extend(self, rules):
         self.__rules.update(rules)
+        self.__predicate = None
+
+    def __getstate__(self):
+        state = super(Conjunction, self).__getstate__()
+        state["_Conjunction__predicate"] = None
+        return state
 
-    def apply(self, item):
-        return reduce(operator.and_, (x.apply(item) for x in self.__rules))
+    def compile(self, selectivity=None):
+        self.__predicate = _compile_predicate(self.get_domain(), self.__rules, selectivity)
+        return self.__predicate
+
+    def apply(self, item, validate=True):
+        if validate and item.get_domain() is not self.get_domain():
+            raise TypeError("Wrong domain")
+        predicate = self.__predicate
+        if predicate is None:
+            predicate = self.compile()
+        return predicate(item)
+
+    def _apply_batch_customized(self, data_set):
+        return reduce(operator.and_, (x.apply_batch(data_set, False) for x in self.__rules), (1 << len(data_set)) - 1)
 
     def remove(self, rule):
         self.__rules.remove(rule)
+        self.__predicate = None
 
     def clear(self):
         self.__rules.clear()
+        self.__predicate = None
 
     def copy(self):
         result = Conjunction(self.get_domain())
@@ -345,43 +914,82 @@ class Conjunction(AbstractRule):
 
 
 class BinomialCoefficientLogarithmComputer(object):
-    def __init__(self):
-        self.__computed = {}
+    max_table_size = 1 << 22
+    __table = array("d", [0.0])
+
+    def reserve(self, n):
+        table = BinomialCoefficientLogarithmComputer.__table
+        if n >= len(table):
+            size = min(max(n + 1, 2 * len(table)), self.max_table_size)
+            value = table[-1]
+            for i in xrange(len(table), size):
+                value += math.log(i)
+                table.append(value)
+        return table
+
     def __logarithm_of_factorial(self, n):
-        if n == 0:
-            return 0
-        if n not in self.__computed:
-            self.__computed[n] = self.__logarithm_of_factorial(n - 1) + math.log(n)
-        return self.__computed[n]
+        table = BinomialCoefficientLogarithmComputer.__table
+        if n < len(table):
+            return table[n]
+        if n >= self.max_table_size:
+            return math.lgamma(n + 1)
+        return self.reserve(n)[n]
 
     def compute(self, n, k):
         return self.__logarithm_of_factorial(n) - self.__logarithm_of_factorial(k) - self.__logarithm_of_factorial(n - k)
 
 
 class AbstractInformativityCriterion(object):
+    separately_convex = False
+
     def _compute_customized(self, N, P, n, p):
         pass
 
-    def compute(self, rule, data_set, class_):
+    def count(self, rule, data_set, class_):
         if not data_set.get_domain().has_class():
             raise ValueError("Entry doesn't contain class column")
 
-        N, P, n, p = 0, 0, 0, 0
-        for entry in data_set:
-            result = rule.apply(entry)
-            if entry.get_class() == class_:
-                P += 1
-                if result:
-                    p += 1
-            else:
-                N += 1
-                if result:
-                    n += 1
+        coverage = rule.apply_batch(data_set)
+        positive = _make_mask([item == class_ for item in data_set.get_classes()])
+        P = _popcount(positive)
+        p = _popcount(coverage & positive)
+        return len(data_set) - P, P, _popcount(coverage) - p, p
 
+    def _compute_many_customized(self, N, P, ns, ps):
+        return [self._compute_customized(N, P, n, p) for n, p in zip(ns, ps)]
+
+    def compute_from_counts(self, N, P, n, p):
         return self._compute_customized(N, P, n, p)
 
+    def compute_many(self, N, P, ns, ps):
+        return self._compute_many_customized(N, P, ns, ps)
+
+    def positives_needed(self, N, P, n, p, max_error, threshold):
+        # A sub-rule of an (n, p) rule covers (n', p') with n' <= n and p' <= p. When the criterion is convex
+        # in n' and in p' separately, its maximum for a fixed p' lies at n' = 0 or at the largest n' the error
+        # bound allows, and its maximum along n' = 0 lies at p' = 0 or p' = p. Scanning p' upwards yields the
+        # smallest positive count for which a sub-rule can still score above threshold.
+        if not self.separately_convex or threshold < 0:
+            return 0
+        positives = range(p + 1)
+        if max_error >= 1:
+            limits = [n] * (p + 1)
+        else:
+            limits = [min(n, int(math.floor(max_error * q / (1.0 - max_error)))) for q in positives]
+        edge = self.compute_many(N, P, limits, positives)
+        pure = self.compute_many(N, P, [0] * (p + 1), positives)
+        for q in positives:
+            if edge[q] > threshold or pure[q] > threshold:
+                return q
+        return p + 1
+
+    def compute(self, rule, data_set, class_):
+        return self.compute_from_counts(*self.count(rule, data_set, class_))
+
 
 class StatisticalCriterion(AbstractInformativityCriterion):
+    separately_convex = True
+
     def __init__(self):
         super(StatisticalCriterion, self).__init__()
         self.__bclc = BinomialCoefficientLogarithmComputer()
@@ -389,8 +997,27 @@ class StatisticalCriterion(AbstractInformativityCriterion):
     def _compute_customized(self, N, P, n, p):
         return -(self.__bclc.compute(P, p) + self.__bclc.compute(N, n) - self.__bclc.compute(P + N, p + n))
 
+    def _compute_many_customized(self, N, P, ns, ps):
+        if P + N >= self.__bclc.max_table_size:
+            return super(StatisticalCriterion, self)._compute_many_customized(N, P, ns, ps)
+        f = self.__bclc.reserve(P + N)
+        constant = f[P + N] - f[P] - f[N]
+        return [constant + f[p] + f[P - p] + f[n] + f[N - n] - f[p + n] - f[P + N - p - n]
+                for n, p in zip(ns, ps)]
+
 
 class EntropyCriterion(AbstractInformativityCriterion):
+    separately_convex = True
+    max_table_size = 1 << 22
+    __table = array("d", [0.0])
+
+    def __reserve(self, n):
+        table = EntropyCriterion.__table
+        if n >= len(table):
+            for x in xrange(len(table), min(max(n + 1, 2 * len(table)), self.max_table_size)):
+                table.append(x * math.log(x, 2))
+        return table
+
     def __compute_entropy(self, P, N):
         if P == 0 or N == 0:
             return 0
@@ -403,43 +1030,75 @@ class EntropyCriterion(AbstractInformativityCriterion):
                       1.0 * (P + N - p - n) / (P + N) * self.__compute_entropy(P - p, N - n)
         return self.__compute_entropy(P, N) - new_entropy
 
+    def _compute_many_customized(self, N, P, ns, ps):
+        # (a + b) * H(a, b) == f(a + b) - f(a) - f(b) with f(x) = x * log2(x)
+        total = P + N
+        if total >= self.max_table_size:
+            return super(EntropyCriterion, self)._compute_many_customized(N, P, ns, ps)
+        f = self.__reserve(total)
+        entropy = self.__compute_entropy(P, N)
+        return [entropy - (f[p + n] - f[p] - f[n] + f[total - p - n] - f[P - p] - f[N - n]) / total
+                for n, p in zip(ns, ps)]
+
 
 class RuleList(object):
     def __init__(self, max_size = 10):
-        self.__list = LinkedList()
+        self.__groups = []
+        self.__keys = []
         self.__cmp = BoolCmp(1e-9)
         self.__max_size = max_size
         self.__rule_set = set()
+        self.__inserts = 0
+        self.__evictions = 0
 
     def insert(self, informativity, rule):
         if rule in self.__rule_set:
-            return
+            return False
         self.__rule_set.add(rule)
+        self.__inserts += 1
 
-        if not self.__list or self.__cmp(self.__list.back().value[0], informativity) > 0:
-            self.__list.push_back([informativity, rule])
+        position = bisect_left(self.__keys, -(informativity + self.__cmp.precision))
+        if position < len(self.__groups) and self.__cmp(self.__groups[position][0], informativity) == 0:
+            self.__groups[position].append(rule)
         else:
-            for node in self.__list:
-                if self.__cmp(node.value[0], informativity) > 0:
-                    continue
-                if self.__cmp(node.value[0], informativity) == 0:
-                    node.value.append(rule)
-                if self.__cmp(node.value[0], informativity) < 0:
-                    self.__list.insert_before(node, [informativity, rule])
-                break
-        if len(self.__rule_set) - (len(self.__list.back().value) - 1) >= self.__max_size:
-            for item in self.__list.back().value[1:]:
+            self.__groups.insert(position, [informativity, rule])
+            self.__keys.insert(position, -informativity)
+        if len(self.__rule_set) - (len(self.__groups[-1]) - 1) >= self.__max_size:
+            for item in self.__groups[-1][1:]:
                 self.__rule_set.remove(item)
-            self.__list.remove(self.__list.back())
+            self.__evictions += len(self.__groups[-1]) - 1
+            self.__groups.pop()
+            self.__keys.pop()
+        return rule in self.__rule_set
+
+    def worst(self):
+        if not self.__groups:
+            return None
+        return self.__groups[-1][0]
+
+    def threshold(self):
+        if len(self.__rule_set) < self.__max_size or not self.__groups:
+            return None
+        # anything at or below this value is evicted as soon as it is inserted
+        return self.__groups[-1][0] - 2 * self.__cmp.precision
+
+    def accepts(self, informativity):
+        if len(self.__rule_set) < self.__max_size or not self.__groups:
+            return True
+        return self.__cmp(self.__groups[-1][0], informativity) <= 0
+
+    def get_statistics(self):
+        return {"inserts": self.__inserts, "evictions": self.__evictions}
 
     def clear(self):
-        self.__list = LinkedList()
+        self.__groups = []
+        self.__keys = []
         self.__rule_set = set()
 
     def __iter__(self):
-        for node in self.__list:
-            for item in node.value[1:]:
-                yield node.value[0], item
+        for group in self.__groups:
+            for item in group[1:]:
+                yield group[0], item
 
     def __len__(self):
         return len(self.__rule_set)
@@ -448,35 +1107,233 @@ class RuleList(object):
         return rule in self.__rule_set
 
 
+class Instrumentation(object):
+    def __init__(self):
+        self.__counters = {}
+        self.__timers = {}
+
+    def on_stage(self, name, seconds):
+        self.__timers[name] = self.__timers.get(name, 0.0) + seconds
+
+    def on_count(self, name, value):
+        self.__counters[name] = self.__counters.get(name, 0) + value
+
+    def get_counters(self):
+        return dict(self.__counters)
+
+    def get_timers(self):
+        return dict(self.__timers)
+
+    def as_dict(self):
+        return {"counters": self.get_counters(), "timers": self.get_timers()}
+
+    def dump(self, f):
+        json.dump(self.as_dict(), f, indent=2, sort_keys=True)
+
+    def clear(self):
+        self.__counters = {}
+        self.__timers = {}
+
+
+class LRUCache(object):
+    def __init__(self, max_size=4096):
+        self.__items = OrderedDict()
+        self.__max_size = max_size
+
+    def get(self, key, default=None):
+        if key not in self.__items:
+            return default
+        value = self.__items.pop(key)
+        self.__items[key] = value
+        return value
+
+    def put(self, key, value):
+        self.__items.pop(key, None)
+        self.__items[key] = value
+        if len(self.__items) > self.__max_size:
+            self.__items.popitem(last=False)
+
+    def clear(self):
+        self.__items.clear()
+
+    def __contains__(self, key):
+        return key in self.__items
+
+    def __len__(self):
+        return len(self.__items)
+
+
+CHECKPOINT_VERSION = 2
+
+
+def _write_checkpoint(path, state):
+    temp_path = path + ".tmp"
+    with open(temp_path, "wb") as f:
+        pickle.dump(state, f, 2)
+    os.rename(temp_path, path)
+
+
+def _read_checkpoint(path):
+    with open(path, "rb") as f:
+        state = pickle.load(f)
+    if state.get("version") != CHECKPOINT_VERSION:
+        raise ValueError("Unsupported checkpoint version")
+    return state
+
+
 class RuleBuilder(object):
-    def __init__(self, train_set, folds=6, test_fraction=0.25):
-        random.seed()
+    def __init__(self, train_set, folds=6, test_fraction=0.25, seed=None, coverage_cache_size=4096,
+                 thresholds="quantile", max_rules_per_feature=64, observer=None):
+        if thresholds not in ("quantile", "boundary"):
+            raise ValueError("Unknown threshold strategy")
+        self.__observer = observer
+        self.__insert_seconds = 0.0
+        start = time.time()
+        rnd = random.Random(seed)
         self.__folds = folds
         self.__test_fraction = test_fraction
-        self.__train_set, self.__test_set = self.__separate(train_set)
-        self.__simple_rules = self.__create_simple_rules()
+        self.__thresholds = thresholds
+        self.__max_rules_per_feature = max_rules_per_feature
+        self.__data_set = train_set
+        self.__train_set, self.__test_set, train_rows, test_rows = self.__separate(train_set, rnd)
+        self.__train_mask = self.__rows_mask(train_rows)
+        self.__test_mask = self.__rows_mask(test_rows)
+        self.__class_masks = self.__create_class_masks()
+        self.__stage("separate", start)
+        self.__coverage_cache = LRUCache(coverage_cache_size)
+        self.__init_simple_rules()
         self.__criterion = None
         self.__max_error = None
         self.__class = None
         self.__max_rank = None
-
-    def __separate(self, data_set):
-        classes = {}
-        test_set = DataSet(data_set.get_domain())
-        train_set = DataSet(data_set.get_domain())
-        for entry in data_set:
-            class_ = entry.get_class()
-            classes[class_] = classes.setdefault(class_, []) + [entry]
-        for k, v in classes.items():
-            train_number = int(len(v) * self.__test_fraction)
-            if train_number == 0 and len(v) > 1:
-                train_number = 1
-            for i in range(train_number):
-                rnd = random.randint(i + 1, len(v) - 1)
-                v[i], v[rnd] = v[rnd], v[i]
-            test_set.extend(v[0:train_number])
-            train_set.extend(v[train_number:])
-        return train_set, test_set
+        self.__criterion_min = None
+        self.__train_part = None
+        self.__test_part = None
+        self.__prune = False
+        self.__rule_positives = None
+        self.__pruning_stats = {"evaluated": 0, "pruned": 0, "duplicates": 0}
+        self.__coverage_index = None
+        self.__last_build = None
+
+    def set_observer(self, observer):
+        self.__observer = observer
+
+    def __stage(self, name, start):
+        if self.__observer is not None:
+            self.__observer.on_stage(name, time.time() - start)
+
+    def __record(self, name, value=1):
+        if self.__observer is not None:
+            self.__observer.on_count(name, value)
+
+    def __insert(self, rule_list, informativity, conjunction):
+        if self.__observer is None:
+            return rule_list.insert(informativity, conjunction)
+        start = time.time()
+        inserted = rule_list.insert(informativity, conjunction)
+        self.__insert_seconds += time.time() - start
+        return inserted
+
+    def __init_simple_rules(self):
+        start = time.time()
+        self.__simple_rules = []
+        self.__coverage = {}
+        seen = set()
+        for rule in self.__create_simple_rules():
+            coverage = self.__compute_coverage(rule)
+            if self.__thresholds == "boundary":
+                if coverage in seen:
+                    continue
+                seen.add(coverage)
+            self.__simple_rules.append(rule)
+            self.__coverage[rule] = coverage
+        self.__rule_indices = dict((rule, index) for index, rule in enumerate(self.__simple_rules))
+        self.__coverage_cache.clear()
+        self.__stage("simple_rules", start)
+
+    def __restore_split(self, train_mask, test_mask):
+        if (train_mask, test_mask) != (self.__train_mask, self.__test_mask):
+            self.__train_set = DataSetView(self.__data_set, array("l", set_bits(train_mask)))
+            self.__test_set = DataSetView(self.__data_set, array("l", set_bits(test_mask)))
+            self.__train_mask, self.__test_mask = train_mask, test_mask
+            self.__init_simple_rules()
+
+    def __checkpoint(self, path, signature, stage, position, rule_list, conjunctions=()):
+        if path is None:
+            return
+        _write_checkpoint(path, {"version": CHECKPOINT_VERSION,
+                                 "signature": signature,
+                                 "train_mask": self.__train_mask,
+                                 "test_mask": self.__test_mask,
+                                 "simple_rules": [str(rule) for rule in self.__simple_rules],
+                                 "stage": stage,
+                                 "position": position,
+                                 "rule_list": [(informativity, self.__indices_of(conjunction))
+                                               for informativity, conjunction in rule_list],
+                                 "conjunctions": [(self.__indices_of(conjunction), informativity)
+                                                  for conjunction, informativity in conjunctions],
+                                 "pruning_stats": self.__pruning_stats,
+                                 # the stabilize/reduce loop never reads the index
+                                 "coverage_index": self.__coverage_index if stage == "rank" else None})
+
+    def __conjunction_of(self, rule_indices):
+        return Conjunction(self.__data_set.get_domain(), [self.__simple_rules[index] for index in rule_indices])
+
+    def __separate(self, data_set, rnd=random):
+        train_rows, test_rows = stratified_split(data_set.get_classes(), self.__test_fraction, rnd)
+        return DataSetView(data_set, train_rows), DataSetView(data_set, test_rows), train_rows, test_rows
+
+    def __rows_mask(self, rows, size=None):
+        flags = [False] * (len(self.__data_set) if size is None else size)
+        for row in rows:
+            flags[row] = True
+        return _make_mask(flags)
+
+    def __create_class_masks(self):
+        classes = self.__data_set.get_classes()
+        return dict((class_, _make_mask(item == class_ for item in classes)) for class_ in set(classes))
+
+    def __compute_coverage(self, rule):
+        self.__record("rule_applications")
+        return rule.apply_batch(self.__data_set)
+
+    def __create_part(self, mask):
+        positive = mask & self.__class_masks.get(self.__class, 0)
+        P = _popcount(positive)
+        return mask, positive, _popcount(mask) - P, P
+
+    def __conjunction_coverage(self, conjunction):
+        rules = frozenset(conjunction)
+        coverage = self.__coverage_cache.get(rules)
+        if coverage is not None:
+            return coverage
+        if len(rules) == 1:
+            return self.__coverage[next(iter(rules))]
+        for rule in rules:
+            parent_coverage = self.__coverage_cache.get(rules - frozenset([rule]))
+            if parent_coverage is not None:
+                coverage = parent_coverage & self.__coverage[rule]
+                break
+        else:
+            coverage = reduce(operator.and_, (self.__coverage[rule] for rule in rules))
+        self.__coverage_cache.put(rules, coverage)
+        return coverage
+
+    def __count(self, coverage, part):
+        mask, positive, N, P = part
+        coverage &= mask
+        p = _popcount(coverage & positive)
+        return N, P, _popcount(coverage) - p, p
+
+    def __evaluate_coverage(self, coverage, part):
+        if self.__observer is not None:
+            self.__observer.on_count("criterion_evaluations", 1)
+            self.__observer.on_count("error_scans", 1)
+        N, P, n, p = self.__count(coverage, part)
+        return self.__criterion.compute_from_counts(N, P, n, p), self.__compute_error(n, p)
+
+    def __evaluate(self, conjunction, part):
+        return self.__evaluate_coverage(self.__conjunction_coverage(conjunction), part)
 
     def __create_simple_rules(self):
         rules = []
@@ -492,8 +1349,11 @@ class RuleBuilder(object):
                         rules.append(SetRule(domain, index, categories))
                         categories.add(category)
 
-            if isinstance(item_type, IntegerType) or isinstance(item_type, FloatType):
-                feature_column = sorted(set(entry.get_items()[index] for entry in self.__train_set))
+            if (isinstance(item_type, IntegerType) or isinstance(item_type, FloatType)) and \
+                    self.__thresholds == "boundary":
+                rules.extend(self.__create_boundary_rules(index))
+            elif isinstance(item_type, IntegerType) or isinstance(item_type, FloatType):
+                feature_column = sorted(set(self.__train_set.get_column(index)))
 
                 step = (len(feature_column) + self.__folds * self.__folds - 1) / (self.__folds * self.__folds)
                 for i in xrange(0, len(feature_column) - 1, step):
@@ -508,29 +1368,51 @@ class RuleBuilder(object):
                     rules.append(RangeRule(domain, index, feature_column[i], feature_column[-1]))
         return rules
 
-    def __compute_error(self, rule, data_set):
-        n, p = 0, 0
-        for entry in data_set:
-            if rule.apply(entry):
-                if entry.get_class() == self.__class:
-                    p += 1
-                else:
-                    n += 1
+    def __create_boundary_rules(self, index):
+        labels = {}
+        for value, class_ in zip(self.__train_set.get_column(index), self.__train_set.get_classes()):
+            labels.setdefault(value, set()).add(class_)
+        values = sorted(labels)
+        thresholds = [(left + right) / 2.0 for left, right in zip(values, values[1:])
+                      if len(labels[left] | labels[right]) > 1]
+
+        if self.__max_rules_per_feature is not None:
+            count = len(thresholds)
+            while count and 2 * count + count * (count - 1) / 2 > self.__max_rules_per_feature:
+                count -= 1
+            thresholds = [thresholds[i * len(thresholds) / count] for i in xrange(count)]
+
+        domain = self.__train_set.get_domain()
+        rules = []
+        for threshold in thresholds:
+            rules.append(LERule(domain, index, threshold))
+            rules.append(GERule(domain, index, threshold))
+        for i, left in enumerate(thresholds):
+            for right in thresholds[i + 1:]:
+                rules.append(RangeRule(domain, index, left, right))
+        return rules
+
+    @staticmethod
+    def __compute_error(n, p):
         if n == 0 and p == 0:
             return 1.0
         return 1.0 * n / (n + p)
 
     def __stabilize(self, conjunction):
-        informativity = self.__criterion.compute(conjunction, self.__train_set, self.__class)
+        informativity, _ = self.__evaluate(conjunction, self.__train_part)
         new_conjunction = conjunction.copy()
-        for rule1 in conjunction:
+        for rule1 in self.__ordered(conjunction):
             best_rule = rule1
+            new_conjunction.remove(best_rule)
+            # -1 has every bit set, so a lone rule is swapped against the whole data set
+            base_coverage = self.__conjunction_coverage(new_conjunction) if new_conjunction else -1
+            new_conjunction.add(best_rule)
             for rule2 in self.__simple_rules:
                 if rule2 not in new_conjunction:
                     new_conjunction.remove(best_rule)
                     new_conjunction.add(rule2)
-                    new_informativity = self.__criterion.compute(new_conjunction, self.__train_set, self.__class)
-                    error = self.__compute_error(new_conjunction, self.__train_set)
+                    new_informativity, error = self.__evaluate_coverage(base_coverage & self.__coverage[rule2],
+                                                                        self.__train_part)
                     if new_informativity < informativity or error >= self.__max_error:
                         new_conjunction.remove(rule2)
                         new_conjunction.add(best_rule)
@@ -539,12 +1421,11 @@ class RuleBuilder(object):
                         best_rule = rule2
         conjunction = new_conjunction
         new_conjunction = conjunction.copy()
-        for rule in conjunction:
+        for rule in self.__ordered(conjunction):
             if len(new_conjunction) == 1:
                 break
             new_conjunction.remove(rule)
-            new_informativity = self.__criterion.compute(new_conjunction, self.__train_set, self.__class)
-            error = self.__compute_error(new_conjunction, self.__train_set)
+            new_informativity, error = self.__evaluate(new_conjunction, self.__train_part)
             if new_informativity < informativity or error >= self.__max_error:
                 new_conjunction.add(rule)
             else:
@@ -553,66 +1434,531 @@ class RuleBuilder(object):
 
 
     def __reduce(self, conjunction):
-        informativity = self.__criterion.compute(conjunction, self.__test_set, self.__class)
+        informativity, _ = self.__evaluate(conjunction, self.__test_part)
         new_conjunction = conjunction.copy()
-        for rule in conjunction:
+        for rule in self.__ordered(conjunction):
             if len(new_conjunction) == 1:
                 break
             new_conjunction.remove(rule)
-            new_informativity = self.__criterion.compute(new_conjunction, self.__test_set, self.__class)
-            error = self.__compute_error(new_conjunction, self.__test_set)
+            new_informativity, error = self.__evaluate(new_conjunction, self.__test_part)
             if new_informativity < informativity or error >= self.__max_error:
                 new_conjunction.add(rule)
             else:
                 informativity = new_informativity
-        #error = self.__compute_error(new_conjunction, self.__train_set)
+        #_, error = self.__evaluate(new_conjunction, self.__train_part)
         #if error >= self.__max_error:
         #    informativity = 0.0
         #    new_conjunction = None
         return informativity, new_conjunction
 
+    def __is_duplicate(self, coverage, rule_indices):
+        key = hash(coverage)
+        known = self.__coverage_index.get(key)
+        if known is None:
+            self.__coverage_index[key] = rule_indices
+            return False
+        # a colliding coverage that differs is simply left out of the index
+        mask = self.__train_part[0]
+        return reduce(operator.and_, (self.__coverage[self.__simple_rules[index]] for index in known)) & mask == coverage
+
+    def _expand(self, rule_indices, threshold, limit=None, start=0, stop=None):
+        conjunction = Conjunction(self.__data_set.get_domain(), [self.__simple_rules[index] for index in rule_indices])
+        parent_coverage = self.__conjunction_coverage(conjunction)
+        indices, ns, ps = [], [], []
+        pruned = 0
+        needed = 0
+        if self.__prune:
+            N, P, parent_n, parent_p = self.__count(parent_coverage, self.__train_part)
+            needed = self.__criterion.positives_needed(N, P, parent_n, parent_p, self.__max_error, threshold)
+            if needed > parent_p:
+                skipped = sum(1 for rule in self.__simple_rules[start:stop] if rule not in conjunction)
+                return indices, ns, ps, skipped, 0
+        duplicates = 0
+        mask = self.__train_part[0]
+        for index, rule in enumerate(self.__simple_rules[start:stop], start):
+            if rule not in conjunction:
+                if needed and self.__rule_positives[index] < needed:
+                    pruned += 1
+                    continue
+                if limit is not None and len(indices) >= limit:
+                    break
+                coverage = parent_coverage & self.__coverage[rule] & mask
+                if self.__coverage_index is not None and self.__is_duplicate(coverage, tuple(rule_indices) + (index,)):
+                    duplicates += 1
+                    continue
+                _, _, n, p = self.__count(coverage, self.__train_part)
+                indices.append(index)
+                ns.append(n)
+                ps.append(p)
+        return indices, ns, ps, pruned, duplicates
+
+    def __expand_chunks(self, tasks, pool, limit=None, deadline=None):
+        rules = len(self.__simple_rules)
+        pieces = max(1, -(-self.__workers * 4 // max(1, len(tasks))))
+        size = max(1, -(-rules // pieces))
+        chunks = [(position, task + (start, start + size))
+                  for position, task in enumerate(tasks) for start in xrange(0, rules, size)]
+        expanded = [([], [], [], 0, 0) for _ in tasks]
+        complete = 0
+        for (position, _), result in izip(chunks, pool.imap(_expand_in_worker, [chunk for _, chunk in chunks])):
+            indices, ns, ps, pruned, duplicates = expanded[position]
+            indices.extend(result[0])
+            ns.extend(result[1])
+            ps.extend(result[2])
+            expanded[position] = indices, ns, ps, pruned + result[3], duplicates + result[4]
+            complete = position + 1
+            if deadline is not None and time.time() > deadline:
+                break
+        if limit is not None:
+            expanded = [(indices[:limit], ns[:limit], ps[:limit], pruned, duplicates)
+                        for indices, ns, ps, pruned, duplicates in expanded]
+        return expanded[:complete]
+
+    def __score_rank(self, parents, pool, threshold, limit=None, deadline=None):
+        tasks = [(self.__indices_of(conjunction), threshold, limit) for _, conjunction in parents]
+        if pool is None:
+            expanded = []
+            for task in tasks:
+                if deadline is not None and time.time() > deadline:
+                    break
+                expanded.append(self._expand(*task))
+        else:
+            expanded = self.__expand_chunks(tasks, pool, limit, deadline)
+        candidates, ns, ps = [], [], []
+        rank_pruned = rank_duplicates = 0
+        for parent, (indices, parent_ns, parent_ps, pruned, duplicates) in zip(parents, expanded):
+            candidates.extend((parent, index) for index in indices)
+            ns.extend(parent_ns)
+            ps.extend(parent_ps)
+            rank_pruned += pruned
+            rank_duplicates += duplicates
+        mask, _, N, P = self.__train_part
+        scores = self.__criterion.compute_many(N, P, ns, ps)
+        accepted = scans = 0
+        for (parent, index), score, n, p in zip(candidates, scores, ns, ps):
+            if score <= self.__criterion_min:
+                continue
+            scans += 1
+            if self.__compute_error(n, p) >= self.__max_error:
+                continue
+            if self.__coverage_index is not None and pool is not None:
+                # workers only de-duplicate against their own candidates
+                coverage = self.__conjunction_coverage(parent[1]) & self.__coverage[self.__simple_rules[index]] & mask
+                if self.__is_duplicate(coverage, self.__indices_of(parent[1]) + (index,)):
+                    rank_duplicates += 1
+                    continue
+            accepted += 1
+            yield parent, index, score
+        self.__pruning_stats["evaluated"] += len(candidates)
+        self.__pruning_stats["pruned"] += rank_pruned
+        self.__pruning_stats["duplicates"] += rank_duplicates
+        if self.__observer is not None and parents:
+            prefix = "rank_{0}_".format(len(parents[0][1]) + 1)
+            self.__record(prefix + "candidates", len(candidates))
+            self.__record(prefix + "rejected", len(candidates) - accepted)
+            self.__record(prefix + "pruned", rank_pruned)
+            self.__record(prefix + "duplicates", rank_duplicates)
+            self.__record("criterion_evaluations", len(ns))
+            self.__record("error_scans", scans)
+
+    def __extend(self, conjunction, index):
+        new_conjunction = conjunction.copy()
+        new_conjunction.add(self.__simple_rules[index])
+        return new_conjunction
+
+    def __expand_rank(self, parents, pool, deadline=None):
+        new_conjunctions = {}
+        for (informativity, conjunction), index, _ in self.__score_rank(parents, pool, self.__criterion_min,
+                                                                        deadline=deadline):
+            new_conjunction = self.__extend(conjunction, index)
+            if new_conjunction not in new_conjunctions:
+                new_conjunctions[new_conjunction] = informativity
+        return new_conjunctions
+
+    def __beam_rank(self, rule_list, parents, pool, candidate_budget, deadline):
+        threshold = self.__criterion_min
+        if rule_list.threshold() is not None:
+            threshold = max(threshold, rule_list.threshold())
+        limit = None
+        if candidate_budget is not None:
+            limit = max(1, (candidate_budget + len(parents) - 1) // len(parents))
+        changed = False
+        for (_, conjunction), index, score in self.__score_rank(parents, pool, threshold, limit, deadline):
+            if self.__insert(rule_list, score, self.__extend(conjunction, index)):
+                changed = True
+        return changed
+
+    def get_selectivity(self):
+        size = float(max(len(self.__data_set), 1))
+        return dict((rule, _popcount(self.__coverage[rule]) / size) for rule in self.__simple_rules)
+
+    def get_split(self):
+        return array("l", self.__train_set.get_indices()), array("l", self.__test_set.get_indices())
+
+    def get_simple_rules(self):
+        return list(self.__simple_rules)
+
+    def get_pruning_stats(self):
+        return dict(self.__pruning_stats)
+
+    def __indices_of(self, conjunction):
+        return tuple(self.__rule_indices[rule] for rule in conjunction)
+
+    def __ordered(self, conjunction):
+        # set order follows object ids; simple-rule order keeps runs reproducible
+        return sorted(conjunction, key=self.__rule_indices.__getitem__)
+
     def build_rules(self,
                     class_,
                     population=10,
                     criterion=StatisticalCriterion(),
                     criterion_min=3,
                     max_error=0.4,
-                    max_rank=4):
+                    max_rank=4,
+                    workers=1,
+                    prune=True,
+                    search="exhaustive",
+                    beam_width=None,
+                    candidate_budget=None,
+                    time_limit=None,
+                    deduplicate_coverage=False,
+                    checkpoint=None,
+                    resume_from=None):
+        global _worker_builder
+
+        if search not in ("exhaustive", "beam"):
+            raise ValueError("Unknown search mode")
+        if search == "exhaustive" and (beam_width is not None or candidate_budget is not None):
+            raise ValueError("beam_width and candidate_budget require search=\"beam\"")
+        if beam_width is not None and beam_width < 1 or candidate_budget is not None and candidate_budget < 1:
+            raise ValueError("beam_width and candidate_budget must be positive")
+        params = dict(class_=class_, population=population, criterion=criterion, criterion_min=criterion_min,
+                      max_error=max_error, max_rank=max_rank, workers=workers, prune=prune, search=search,
+                      beam_width=beam_width, candidate_budget=candidate_budget, time_limit=time_limit,
+                      deduplicate_coverage=deduplicate_coverage)
+        signature = (class_, population, type(criterion).__name__, criterion_min, max_error, max_rank, prune,
+                     search, beam_width, candidate_budget, deduplicate_coverage)
+        state = None
+        if resume_from is not None:
+            state = _read_checkpoint(resume_from)
+            if state["signature"] != signature:
+                raise ValueError("Checkpoint was written with different parameters")
+            self.__restore_split(state["train_mask"], state["test_mask"])
+            if state["simple_rules"] != [str(rule) for rule in self.__simple_rules]:
+                raise ValueError("Checkpoint does not match the data set")
+        deadline = None
+        if time_limit is not None:
+            deadline = time.time() + time_limit
+        if beam_width is None:
+            beam_width = population
 
         self.__max_rank = max_rank
         self.__criterion = criterion
+        self.__criterion_min = criterion_min
         self.__max_error = max_error
         self.__class = class_
-
+        self.__train_part = self.__create_part(self.__train_mask)
+        self.__test_part = self.__create_part(self.__test_mask)
+        self.__prune = prune
+        self.__workers = workers
+        self.__pruning_stats = {"evaluated": 0, "pruned": 0, "duplicates": 0}
+        self.__coverage_index = None
+        if deduplicate_coverage:
+            mask = self.__train_part[0]
+            self.__coverage_index = {}
+            for index, rule in enumerate(self.__simple_rules):
+                self.__is_duplicate(self.__coverage[rule] & mask, (index,))
+        if prune:
+            positive = self.__train_part[1]
+            self.__rule_positives = [_popcount(self.__coverage[rule] & positive) for rule in self.__simple_rules]
+
+        self.__insert_seconds = 0.0
         rule_list = RuleList(population)
-        for rule in self.__simple_rules:
-            conjunction = Conjunction(self.__train_set.get_domain(), [rule])
-            rule_list.insert(criterion.compute(conjunction, self.__train_set, class_), conjunction)
-
-        for rank in range(2, self.__max_rank + 1):
-            new_conjunctions = {}
-            for informativity, conjunction in rule_list:
-                if len(conjunction) == rank - 1:
-                    new_conjunction = conjunction.copy()
-                    for rule in self.__simple_rules:
-                        if rule not in new_conjunction:
-                            new_conjunction.add(rule)
-                            if new_conjunction not in new_conjunctions:
-                                new_informativity = criterion.compute(new_conjunction, self.__train_set, class_)
-                                error = self.__compute_error(new_conjunction, self.__train_set)
-                                if new_informativity > criterion_min and error < max_error:
-                                    new_conjunctions[new_conjunction.copy()] = informativity
-                            new_conjunction.remove(rule)
-            if new_conjunctions:
-                break
-            for conjunction, informativity in new_conjunctions.items():
-                rule_list.insert(informativity, conjunction)
+        stage, position = "rank", 2
+        if state is not None:
+            stage, position = state["stage"], state["position"]
+            self.__pruning_stats = dict(state["pruning_stats"])
+            self.__coverage_index = state["coverage_index"]
+            for informativity, rule_indices in state["rule_list"]:
+                rule_list.insert(informativity, self.__conjunction_of(rule_indices))
+        else:
+            start = time.time()
+            for rule in self.__simple_rules:
+                conjunction = Conjunction(self.__train_set.get_domain(), [rule])
+                self.__insert(rule_list, self.__evaluate(conjunction, self.__train_part)[0], conjunction)
+            self.__stage("initial_scoring", start)
+
+        pool = None
+        if workers > 1 and stage == "rank":
+            _worker_builder = self
+            pool = multiprocessing.Pool(workers)
+        try:
+            for rank in range(position if stage == "rank" else self.__max_rank + 1, self.__max_rank + 1):
+                self.__checkpoint(checkpoint, signature, "rank", rank, rule_list)
+                start = time.time()
+                parents = [(informativity, conjunction) for informativity, conjunction in rule_list
+                           if len(conjunction) == rank - 1]
+                if search == "beam":
+                    if not parents or (deadline is not None and time.time() > deadline):
+                        break
+                    changed = self.__beam_rank(rule_list, parents[:beam_width], pool, candidate_budget, deadline)
+                    self.__stage("rank_{0}".format(rank), start)
+                    if not changed:
+                        break
+                    continue
+                if deadline is not None and time.time() > deadline:
+                    break
+                new_conjunctions = self.__expand_rank(parents, pool, deadline)
+                self.__stage("rank_{0}".format(rank), start)
+                if new_conjunctions:
+                    break
+                for conjunction, informativity in new_conjunctions.items():
+                    self.__insert(rule_list, informativity, conjunction)
+        finally:
+            if pool is not None:
+                if deadline is not None and time.time() > deadline:
+                    pool.terminate()
+                else:
+                    pool.close()
+                pool.join()
+                _worker_builder = None
 
         conjunctions = {}
-        for informativity, conjunction in rule_list:
-            informativity, conjunction = self.__stabilize(conjunction)
+        shortest = {}
+        if stage == "final":
+            for rule_indices, informativity in state["conjunctions"]:
+                conjunctions[self.__conjunction_of(rule_indices)] = informativity
+            if deduplicate_coverage:
+                shortest = dict((self.__conjunction_coverage(conjunction), conjunction) for conjunction in conjunctions)
+        else:
+            position = 0
+        stabilize_seconds = reduce_seconds = 0.0
+        for index, (informativity, conjunction) in enumerate(list(rule_list)):
+            if index < position:
+                continue
+            self.__checkpoint(checkpoint, signature, "final", index, rule_list, conjunctions.items())
+            start = time.time()
+            if deadline is None or start <= deadline:
+                informativity, conjunction = self.__stabilize(conjunction)
+            stabilized = time.time()
             informativity, conjunction = self.__reduce(conjunction)
-            if conjunction is not None:
-                conjunctions[conjunction] = informativity
+            stabilize_seconds += stabilized - start
+            reduce_seconds += time.time() - stabilized
+            if conjunction is None:
+                continue
+            if deduplicate_coverage:
+                coverage = self.__conjunction_coverage(conjunction)
+                if coverage in shortest:
+                    if len(shortest[coverage]) <= len(conjunction):
+                        continue
+                    del conjunctions[shortest[coverage]]
+                shortest[coverage] = conjunction
+            conjunctions[conjunction] = informativity
+        self.__checkpoint(checkpoint, signature, "final", len(rule_list), rule_list, conjunctions.items())
+
+        if self.__observer is not None:
+            self.__observer.on_stage("stabilize", stabilize_seconds)
+            self.__observer.on_stage("reduce", reduce_seconds)
+            self.__observer.on_stage("rule_list_insert", self.__insert_seconds)
+            statistics = rule_list.get_statistics()
+            self.__record("rule_list_inserts", statistics["inserts"])
+            self.__record("rule_list_evictions", statistics["evictions"])
+        self.__remember(params, conjunctions)
+        return conjunctions
 
+    def __simple_top(self, N, P, counts):
+        last = self.__last_build["params"]
+        scores = last["criterion"].compute_many(N, P, [n for n, _ in counts], [p for _, p in counts])
+        rule_list = RuleList(last["population"])
+        for index, score in enumerate(scores):
+            rule_list.insert(score, index)
+        return frozenset(index for _, index in rule_list)
+
+    def __remember(self, params, conjunctions):
+        self.__last_build = {"params": params,
+                             "train": self.__train_part[2:],
+                             "test": self.__test_part[2:],
+                             "simple": [self.__count(self.__coverage[rule], self.__train_part)[2:]
+                                        for rule in self.__simple_rules],
+                             "top": [(self.__indices_of(conjunction),
+                                      self.__count(self.__conjunction_coverage(conjunction), self.__test_part)[2:])
+                                     for conjunction in conjunctions]}
+        self.__last_build["floor"] = min(conjunctions.values()) if conjunctions else None
+        self.__last_build["simple_top"] = self.__simple_top(self.__train_part[2], self.__train_part[3],
+                                                            self.__last_build["simple"])
+
+    def append_rows(self, data_set, seed=None, tolerance=0.05):
+        if data_set.get_domain() is not self.__data_set.get_domain():
+            raise TypeError("Wrong domain")
+        start = time.time()
+        offset = len(self.__data_set)
+        size = len(data_set)
+        classes = data_set.get_classes()
+        train_rows, test_rows = stratified_split(classes, self.__test_fraction, random.Random(seed))
+        train_mask, test_mask = self.__rows_mask(train_rows, size), self.__rows_mask(test_rows, size)
+        class_masks = dict((class_, _make_mask(item == class_ for item in classes)) for class_ in set(classes))
+
+        self.__data_set.extend(data_set)
+        delta_coverage = {}
+        for rule in self.__simple_rules:
+            coverage = rule.apply_batch(data_set, False)
+            delta_coverage[rule] = coverage
+            self.__coverage[rule] |= coverage << offset
+        for class_, mask in class_masks.items():
+            self.__class_masks[class_] = self.__class_masks.get(class_, 0) | mask << offset
+        self.__train_mask |= train_mask << offset
+        self.__test_mask |= test_mask << offset
+        self.__train_set.get_indices().extend(row + offset for row in train_rows)
+        self.__test_set.get_indices().extend(row + offset for row in test_rows)
+        self.__coverage_cache.clear()
+        self.__record("rows_appended", size)
+        self.__stage("append_rows", start)
+        if self.__last_build is None:
+            return None
+
+        start = time.time()
+        last = self.__last_build
+        params = last["params"]
+        positive = class_masks.get(params["class_"], 0)
+        train_part = (train_mask, train_mask & positive,
+                      _popcount(train_mask & ~positive), _popcount(train_mask & positive))
+        test_part = (test_mask, test_mask & positive,
+                     _popcount(test_mask & ~positive), _popcount(test_mask & positive))
+        N, P = last["train"][0] + train_part[2], last["train"][1] + train_part[3]
+        simple = []
+        for rule, (n, p) in zip(self.__simple_rules, last["simple"]):
+            _, _, delta_n, delta_p = self.__count(delta_coverage[rule], train_part)
+            simple.append((n + delta_n, p + delta_p))
+        simple_top = self.__simple_top(N, P, simple)
+
+        test_N, test_P = last["test"][0] + test_part[2], last["test"][1] + test_part[3]
+        top = []
+        conjunctions = {}
+        for rule_indices, (n, p) in last["top"]:
+            coverage = reduce(operator.and_, (delta_coverage[self.__simple_rules[index]] for index in rule_indices))
+            _, _, delta_n, delta_p = self.__count(coverage, test_part)
+            n, p = n + delta_n, p + delta_p
+            top.append((rule_indices, (n, p)))
+            conjunctions[self.__conjunction_of(rule_indices)] = params["criterion"].compute_from_counts(
+                test_N, test_P, n, p)
+        self.__stage("rescore", start)
+
+        # a lower floor or a different single-rule top can let other candidates in
+        floor = min(conjunctions.values()) if conjunctions else None
+        if simple_top != last["simple_top"] or (floor is not None and (
+                floor < params["criterion_min"] or floor < last["floor"] - tolerance * abs(last["floor"]))):
+            self.__record("rebuilds")
+            return self.build_rules(**params)
+
+        # the floor stays at the last full build so that small drops cannot accumulate unnoticed
+        last.update(train=(N, P), test=(test_N, test_P), simple=simple, top=top, simple_top=simple_top)
         return conjunctions
+
+    def _build_indexed(self, class_, criterion, params, split=None):
+        masks = self.__train_mask, self.__test_mask
+        last_build = self.__last_build
+        if split is not None:
+            self.__train_mask, self.__test_mask = split
+        try:
+            rules = self.build_rules(class_, criterion=criterion, **params)
+        finally:
+            if split is not None:
+                self.__train_mask, self.__test_mask = masks
+                self.__last_build = last_build
+        return [(self.__indices_of(conjunction), informativity) for conjunction, informativity in rules.items()]
+
+    def __class_rows(self, rnd):
+        rows = []
+        for class_ in sorted(self.__class_masks):
+            class_rows = list(set_bits(self.__class_masks[class_]))
+            rnd.shuffle(class_rows)
+            rows.append(class_rows)
+        return rows
+
+    def __resampled_splits(self, repeats, folds, seed):
+        rnd = random.Random(seed)
+        full_mask = (1 << len(self.__data_set)) - 1
+        splits = []
+        if folds is not None:
+            fold_rows = [[] for _ in range(folds)]
+            for class_rows in self.__class_rows(rnd):
+                for position, row in enumerate(class_rows):
+                    fold_rows[position % folds].append(row)
+            for rows in fold_rows:
+                test_mask = self.__rows_mask(rows)
+                splits.append((full_mask & ~test_mask, test_mask))
+            return splits
+        classes = self.__data_set.get_classes()
+        for _ in range(repeats):
+            train_rows, test_rows = stratified_split(classes, self.__test_fraction, rnd)
+            splits.append((self.__rows_mask(train_rows), self.__rows_mask(test_rows)))
+        return splits
+
+    def build_rules_resampled(self, class_, criterion=StatisticalCriterion(), repeats=10, folds=None, seed=None,
+                              workers=None, **params):
+        global _worker_builder
+
+        splits = self.__resampled_splits(repeats, folds, seed)
+        jobs = [(class_, criterion, dict(params, workers=1), split) for split in splits]
+        if workers is None:
+            workers = min(len(jobs), multiprocessing.cpu_count())
+        if workers <= 1:
+            results = [self._build_indexed(*job) for job in jobs]
+        else:
+            _worker_builder = self
+            pool = multiprocessing.Pool(workers)
+            try:
+                results = pool.map(_build_in_worker, jobs, chunksize=1)
+            finally:
+                pool.close()
+                pool.join()
+                _worker_builder = None
+
+        counts = {}
+        totals = {}
+        for result in results:
+            for rule_indices, informativity in result:
+                key = tuple(sorted(rule_indices))
+                counts[key] = counts.get(key, 0) + 1
+                totals[key] = totals.get(key, 0.0) + informativity
+        ranked = sorted(counts, key=lambda key: (-counts[key], -totals[key] / counts[key], key))
+        return [(self.__conjunction_of(key), float(counts[key]) / len(splits), totals[key] / counts[key])
+                for key in ranked]
+
+    def build_rules_multi(self, jobs, workers=None):
+        global _worker_builder
+
+        jobs = [(class_, criterion, dict(params, workers=1)) for class_, criterion, params in jobs]
+        if workers is None:
+            workers = min(len(jobs), multiprocessing.cpu_count())
+        if workers <= 1:
+            return [self.build_rules(class_, criterion=criterion, **params) for class_, criterion, params in jobs]
+
+        _worker_builder = self
+        pool = multiprocessing.Pool(workers)
+        try:
+            results = pool.map(_build_in_worker, jobs, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+            _worker_builder = None
+
+        domain = self.__data_set.get_domain()
+        rules = []
+        for result in results:
+            conjunctions = {}
+            for rule_indices, informativity in result:
+                conjunctions[Conjunction(domain, [self.__simple_rules[index] for index in rule_indices])] = informativity
+            rules.append(conjunctions)
+        return rules
+
+
+_worker_builder = None
+
+
+def _expand_in_worker(task):
+    return _worker_builder._expand(*task)
+
+
+def _build_in_worker(job):
+    return _worker_builder._build_indexed(*job)
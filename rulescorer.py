@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import sys
+import time
+import argparse
+import contextlib
+from array import array
+from itertools import islice
+from rulebuilder import Domain, ColumnarDataSet, EquivalenceRule, SetRule, LERule, GERule, RangeRule, Conjunction, \
+    set_bits
+
+RULE_TYPES = dict((rule_type.get_type(), rule_type)
+                  for rule_type in (EquivalenceRule, SetRule, LERule, GERule, RangeRule))
+
+
+def _parse_number(text):
+    try:
+        return int(text)
+    except ValueError:
+        return float(text)
+
+
+def parse_rule(domain, text):
+    try:
+        rule_type, index, values = text.strip().split(":", 2)
+        rule_type, index = RULE_TYPES[int(rule_type)], int(index) - 1
+    except (ValueError, KeyError):
+        raise ValueError("Wrong rule format: {0}".format(text))
+    if not values.startswith("{") or not values.endswith("}") or not 0 <= index < len(domain.get_item_types()):
+        raise ValueError("Wrong rule format: {0}".format(text))
+    values = values[1:-1]
+    if rule_type is EquivalenceRule:
+        return EquivalenceRule(domain, index, values)
+    if rule_type is SetRule:
+        return SetRule(domain, index, values.split(","))
+    if rule_type is RangeRule:
+        left, right = values.split(",")
+        return RangeRule(domain, index, _parse_number(left), _parse_number(right))
+    return rule_type(domain, index, _parse_number(values))
+
+
+def parse_rule_line(domain, line):
+    fields = line.strip().split(";")
+    if len(fields) < 3:
+        raise ValueError("Wrong rule line: {0}".format(line))
+    class_ = domain.get_class_type().cast(fields[0])
+    conjunction = Conjunction(domain, [parse_rule(domain, text) for text in fields[1:-1]])
+    return class_, conjunction, float(fields[-1])
+
+
+def load_rules(path, domain):
+    with contextlib.closing(open(path)) as f:
+        return [parse_rule_line(domain, line) for line in f if line.strip()]
+
+
+class RuleScorer(object):
+    def __init__(self, domain, rules):
+        self.__domain = domain
+        self.__record_domain = Domain(domain.get_item_types(), has_class=False)
+        self.__rules = list(rules)
+        self.__classes = sorted(set(class_ for class_, conjunction, informativity in self.__rules))
+
+    def get_rules(self):
+        return list(self.__rules)
+
+    def get_classes(self):
+        return list(self.__classes)
+
+    def create_data_set(self):
+        return ColumnarDataSet(self.__record_domain)
+
+    def score_batch(self, data_set):
+        if data_set.get_domain() is not self.__domain and data_set.get_domain() is not self.__record_domain:
+            raise TypeError("Wrong domain")
+        votes = dict((class_, array("d", [0.0]) * len(data_set)) for class_ in self.__classes)
+        for class_, conjunction, informativity in self.__rules:
+            column = votes[class_]
+            for row in set_bits(conjunction.apply_batch(data_set, False)):
+                column[row] += informativity
+        return votes
+
+    def classify_batch(self, data_set, default=None):
+        votes = self.score_batch(data_set)
+        labels = []
+        for row in xrange(len(data_set)):
+            best, best_vote = default, 0.0
+            for class_ in self.__classes:
+                if votes[class_][row] > best_vote:
+                    best, best_vote = class_, votes[class_][row]
+            labels.append(best)
+        return labels
+
+    def score_entry(self, entry):
+        votes = dict((class_, 0.0) for class_ in self.__classes)
+        for class_, conjunction, informativity in self.__rules:
+            if conjunction.apply(entry, False):
+                votes[class_] += informativity
+        return votes
+
+    def __chunks(self, raw_records, chunk_size):
+        raw_records = iter(raw_records)
+        while True:
+            chunk = list(islice(raw_records, chunk_size))
+            if not chunk:
+                break
+            data_set = self.create_data_set()
+            data_set.extend_raw(chunk, chunk_size)
+            yield data_set
+
+    def score_stream(self, raw_records, chunk_size=65536):
+        for data_set in self.__chunks(raw_records, chunk_size):
+            votes = self.score_batch(data_set)
+            for row in xrange(len(data_set)):
+                yield dict((class_, votes[class_][row]) for class_ in self.__classes)
+
+    def classify_stream(self, raw_records, chunk_size=65536, default=None):
+        for data_set in self.__chunks(raw_records, chunk_size):
+            for label in self.classify_batch(data_set, default):
+                yield label
+
+    def benchmark(self, raw_records, chunk_size=65536, repeat=3):
+        raw_records = list(raw_records)
+        best = None
+        for _ in range(repeat):
+            start = time.time()
+            for _ in self.classify_stream(raw_records, chunk_size):
+                pass
+            elapsed = time.time() - start
+            if best is None or elapsed < best:
+                best = elapsed
+        return {"records": len(raw_records),
+                "rules": len(self.__rules),
+                "seconds": best,
+                "records_per_second": len(raw_records) / best if best else float("inf")}
+
+
+def load_scorer(path, domain):
+    return RuleScorer(domain, load_rules(path, domain))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Classify records with a stored rule set.")
+    parser.add_argument("rules")
+    parser.add_argument("data")
+    parser.add_argument("--benchmark", action="store_true", help="report classification throughput")
+    args = parser.parse_args(argv)
+
+    from main import create_domain
+    scorer = load_scorer(args.rules, create_domain())
+    with contextlib.closing(open(args.data)) as f:
+        for label in scorer.classify_stream(line.split() for line in f if line.strip()):
+            sys.stdout.write("{0}\n".format(label))
+    if args.benchmark:
+        with contextlib.closing(open(args.data)) as f:
+            result = scorer.benchmark(line.split() for line in f if line.strip())
+        sys.stderr.write("{0[records_per_second]:.0f} records/s\n".format(result))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
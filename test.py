@@ -1,8 +1,19 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
+import os
+import json
+import math
+import pickle
+import random
+import shutil
+import tempfile
 import unittest
+from copy import deepcopy
 from linkedlist import LinkedList
 from rulebuilder import *
+from datacache import load_data_set, read_cache
+from rulescorer import RuleScorer, parse_rule, parse_rule_line
+from benchmark import compare
 
 class TestLinkedList(unittest.TestCase):
     def test_empty_list(self):
@@ -150,6 +161,22 @@ class TestRuleList(unittest.TestCase):
         test_list = [(9,900), (8.5, 88), (8.5, 888), (8.5, 8888), (8, 800)]
         self.assertEqual(test_list, list(rlist))
 
+    def test_worst_and_accepts(self):
+        rlist = RuleList(3)
+        self.assertIsNone(rlist.worst())
+        self.assertIsNone(rlist.threshold())
+        self.assertTrue(rlist.accepts(-100))
+        for i in range(5):
+            self.assertTrue(rlist.insert(i, i * 100))
+        self.assertEqual(rlist.worst(), 2)
+        self.assertAlmostEqual(rlist.threshold(), 2)
+        self.assertFalse(rlist.accepts(1))
+        self.assertTrue(rlist.accepts(2))
+        self.assertFalse(rlist.insert(1, 1000))
+        self.assertFalse(rlist.insert(3, 300))
+        self.assertTrue(rlist.insert(2, 2000))
+        self.assertEqual(list(rlist), [(4, 400), (3, 300), (2, 200), (2, 2000)])
+
     def test_clear(self):
         rlist = RuleList(5)
         for i in range(10):
@@ -161,5 +188,578 @@ class TestRuleList(unittest.TestCase):
             self.assertTrue(False)
 
 
+class TestCriteria(unittest.TestCase):
+    def test_compute_many_matches_scalar(self):
+        for N, P in ((37, 23), (4, 2), (90, 61)):
+            ns = [n for n in range(N + 1) for p in range(P + 1)]
+            ps = [p for n in range(N + 1) for p in range(P + 1)]
+            for criterion in (StatisticalCriterion(), EntropyCriterion()):
+                for n, p, value in zip(ns, ps, criterion.compute_many(N, P, ns, ps)):
+                    self.assertAlmostEqual(value, criterion.compute_from_counts(N, P, n, p), places=9)
+
+    def test_compute_matches_counts(self):
+        data_set = make_data_set(120, seed=11)
+        domain = data_set.get_domain()
+        rules = [EquivalenceRule(domain, 0, "A"), LERule(domain, 1, 20), GERule(domain, 2, 5.0),
+                 Conjunction(domain, [SetRule(domain, 0, ["A", "B"]), GERule(domain, 1, 10)])]
+        for criterion in (StatisticalCriterion(), EntropyCriterion()):
+            for rule in rules:
+                for class_ in (1, 2):
+                    N, P, n, p = criterion.count(rule, data_set, class_)
+                    covered = [entry for entry in data_set if rule.apply(entry)]
+                    self.assertEqual(P, sum(1 for entry in data_set if entry.get_class() == class_))
+                    self.assertEqual(N, len(data_set) - P)
+                    self.assertEqual(p, sum(1 for entry in covered if entry.get_class() == class_))
+                    self.assertEqual(n, len(covered) - p)
+                    self.assertEqual(criterion.compute(rule, data_set, class_),
+                                     criterion.compute_from_counts(N, P, n, p))
+
+    def test_positives_needed_bound(self):
+        rnd = random.Random(12)
+        for criterion in (StatisticalCriterion(), EntropyCriterion()):
+            for _ in range(100):
+                N, P = rnd.randint(1, 40), rnd.randint(1, 40)
+                n, p = rnd.randint(0, N), rnd.randint(0, P)
+                max_error = rnd.choice((0.1, 0.25, 0.4, 1.0))
+                grid = [(n_, p_) for n_ in range(n + 1) for p_ in range(p + 1)
+                        if max_error >= 1 or (n_ or p_) and 1.0 * n_ / (n_ + p_) < max_error]
+                scores = criterion.compute_many(N, P, [n_ for n_, _ in grid], [p_ for _, p_ in grid])
+                threshold = rnd.random() * max(scores + [1.0])
+                needed = criterion.positives_needed(N, P, n, p, max_error, threshold)
+                for (n_, p_), score in zip(grid, scores):
+                    if p_ < needed:
+                        self.assertLessEqual(score, threshold + 1e-9)
+
+    def test_binomial_logarithm_on_large_counts(self):
+        computer = BinomialCoefficientLogarithmComputer()
+        for n, k in [(5000, 1200), (20000, 3), (10, 0), (computer.max_table_size + 10, 100)]:
+            expected = math.lgamma(n + 1) - math.lgamma(k + 1) - math.lgamma(n - k + 1)
+            self.assertAlmostEqual(computer.compute(n, k), expected, delta=1e-6 * max(1.0, expected))
+        self.assertAlmostEqual(StatisticalCriterion().compute_from_counts(3000, 2000, 10, 900),
+                               StatisticalCriterion().compute_many(3000, 2000, [10], [900])[0])
+
+
+class TestLRUCache(unittest.TestCase):
+    def test_eviction(self):
+        cache = LRUCache(2)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        self.assertEqual(cache.get("a"), 1)
+        cache.put("c", 3)
+        self.assertNotIn("b", cache)
+        self.assertEqual(cache.get("a"), 1)
+        self.assertEqual(cache.get("c"), 3)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(len(cache), 2)
+
+
+class TestColumnarDataSet(unittest.TestCase):
+    def setUp(self):
+        self.domain = Domain((CategoricalType("A", "B", "C"), IntegerType(), FloatType(), IntegerType()))
+        self.raw = [["A", "1", "0.5", "1"], ["C", "7", "2.5", "2"], ["B", "3", "1.0", "1"]]
+
+    def test_rows_match_data_set(self):
+        data_set = DataSet(self.domain)
+        data_set.extend_raw(self.raw)
+        columnar = ColumnarDataSet(self.domain)
+        columnar.extend_raw(self.raw)
+        self.assertEqual(len(columnar), len(data_set))
+        for entry, row in zip(data_set, columnar):
+            self.assertEqual(list(entry.get_items()), list(row.get_items()))
+            self.assertEqual(entry.get_class(), row.get_class())
+            self.assertIs(row.get_domain(), self.domain)
+        for index in range(3):
+            self.assertEqual(list(data_set.get_column(index)), list(columnar.get_column(index)))
+        self.assertEqual(data_set.get_classes(), columnar.get_classes())
+
+    def test_encoding(self):
+        columnar = ColumnarDataSet(self.domain)
+        columnar.extend_raw(self.raw)
+        self.assertEqual(list(columnar.get_codes(0)), [0, 2, 1])
+        self.assertEqual(columnar.get_categories(0), ("A", "B", "C"))
+        self.assertRaises(TypeError, columnar.append_raw, ["D", "1", "0.5", "1"])
+        self.assertEqual(len(columnar), 3)
+
+    def test_chunked_extend_raw(self):
+        progress = []
+        columnar = ColumnarDataSet(self.domain)
+        columnar.extend_raw(iter(self.raw), chunk_size=2, progress=lambda rows, seconds: progress.append(rows))
+        self.assertEqual(progress, [2, 3])
+        data_set = read_data_set([" ".join(raw) + "\n" for raw in self.raw], self.domain)
+        for row1, row2 in zip(columnar, data_set):
+            self.assertEqual(list(row1.get_items()), list(row2.get_items()))
+            self.assertEqual(row1.get_class(), row2.get_class())
+        self.assertRaises(TypeError, columnar.extend_raw, [["A", "1", "0.5", "1"], ["D", "1", "0.5", "1"]])
+        self.assertRaises(ValueError, columnar.extend_raw, [["A", "1", "0.5"]])
+        self.assertEqual(len(columnar), 3)
+
+    def test_items_behave_like_list(self):
+        columnar = ColumnarDataSet(self.domain)
+        columnar.extend_raw(self.raw)
+        data_set = DataSet(self.domain)
+        data_set.extend_raw(self.raw)
+        for row, entry in zip(columnar, data_set):
+            items, expected = row.get_items(), entry.get_items()
+            self.assertEqual(items[0:2], expected[0:2])
+            self.assertEqual(items[::-1], expected[::-1])
+            self.assertEqual(items[-1], expected[-1])
+            self.assertTrue(items == expected)
+            self.assertFalse(items != expected)
+            self.assertEqual(items == expected[:2], expected == expected[:2])
+            self.assertEqual(items + ["x"], expected + ["x"])
+            self.assertEqual(["x"] + items, ["x"] + expected)
+            self.assertEqual(items + row.get_items(), expected + expected)
+        self.assertNotEqual(columnar[0].get_items(), columnar[1].get_items())
+
+    def test_set_and_delete(self):
+        columnar = ColumnarDataSet(self.domain)
+        columnar.extend_raw(self.raw)
+        columnar[0] = columnar[1]
+        self.assertEqual(list(columnar[0].get_items()), ["C", 7, 2.5])
+        del columnar[1]
+        self.assertEqual(len(columnar), 2)
+        self.assertEqual(columnar[-1].get_items()[0], "B")
+        self.assertEqual(columnar.get_classes(), [2, 1])
+
+
+class TestApplyBatch(unittest.TestCase):
+    def setUp(self):
+        self.domain = Domain((CategoricalType("A", "B", "C"), IntegerType(), FloatType(), IntegerType()))
+        self.raw = [["A", "1", "0.5", "1"], ["C", "7", "2.5", "2"], ["B", "3", "1.0", "1"], ["A", "5", "4.0", "2"]]
+        self.rules = [EquivalenceRule(self.domain, 0, "A"), SetRule(self.domain, 0, ["B", "C"]),
+                      LERule(self.domain, 1, 4.5), GERule(self.domain, 2, 1.0), RangeRule(self.domain, 1, 3, 7)]
+
+    def test_matches_apply(self):
+        for data_set in (DataSet(self.domain), ColumnarDataSet(self.domain)):
+            data_set.extend_raw(self.raw)
+            for rule in self.rules + [Conjunction(self.domain, self.rules[2:4])]:
+                mask = rule.apply_batch(data_set)
+                for row, entry in enumerate(data_set):
+                    self.assertEqual(bool(mask >> row & 1), rule.apply(entry))
+            self.assertEqual(Conjunction(self.domain).apply_batch(data_set), 0b1111)
+
+    def test_wrong_domain(self):
+        data_set = DataSet(Domain((IntegerType(), IntegerType())))
+        self.assertRaises(TypeError, self.rules[0].apply_batch, data_set)
+
+    def test_interned_domain(self):
+        domain = Domain((CategoricalType("C", "B", "A"), IntegerType(), FloatType(), IntegerType()))
+        self.assertIs(domain, self.domain)
+        other = Domain((CategoricalType("A", "B"), IntegerType(), FloatType(), IntegerType()))
+        self.assertIsNot(other, self.domain)
+        entry = DataEntry(other, ["A", "1", "0.5", "1"])
+        self.assertRaises(TypeError, self.rules[0].apply, entry)
+        self.assertTrue(self.rules[0].apply(entry, validate=False))
+
+    def test_compiled_conjunction(self):
+        data_set = DataSet(self.domain)
+        data_set.extend_raw(self.raw)
+        extra = [LERule(self.domain, 1, 6), GERule(self.domain, 1, 2), RangeRule(self.domain, 2, 0.5, 3.0)]
+        conjunction = Conjunction(self.domain, self.rules[1:] + extra)
+        for members in ([], self.rules[1:], [self.rules[0], self.rules[1]], extra, self.rules[2:] + extra):
+            conjunction.clear()
+            conjunction.extend(members)
+            conjunction.compile({self.rules[2]: 0.9})
+            for entry in data_set:
+                self.assertEqual(conjunction.apply(entry), all(rule.apply(entry) for rule in members))
+        conjunction.clear()
+        conjunction.add(self.rules[0])
+        self.assertEqual([conjunction.apply(entry) for entry in data_set], [True, False, False, True])
+        conjunction.add(GERule(self.domain, 1, 2))
+        self.assertEqual([conjunction.apply(entry) for entry in data_set], [False, False, False, True])
+
+    def test_pickle_and_copy(self):
+        entry = DataEntry(self.domain, self.raw[0])
+        conjunction = Conjunction(self.domain, self.rules)
+        conjunction.apply(entry)
+        for protocol in (0, 1, 2):
+            domain, copied, rules = pickle.loads(pickle.dumps((self.domain, entry, [conjunction] + self.rules), protocol))
+            self.assertIs(domain, self.domain)
+            self.assertEqual((copied.get_items(), copied.get_class()), (entry.get_items(), entry.get_class()))
+            self.assertEqual([sorted(str(rule).split(";")) for rule in rules],
+                             [sorted(str(rule).split(";")) for rule in [conjunction] + self.rules])
+            self.assertEqual([rule.apply(entry) for rule in rules], [rule.apply(entry) for rule in [conjunction] + self.rules])
+        self.assertIs(deepcopy(self.domain), self.domain)
+        self.assertEqual(sorted(str(deepcopy(conjunction)).split(";")), sorted(str(conjunction).split(";")))
+        llist = LinkedList()
+        llist.push_back(1)
+        self.assertEqual(pickle.loads(pickle.dumps(llist._fake_node._next, 0)).value, 1)
+
+    def test_domain_identity(self):
+        other = Domain((CategoricalType("A", "B"), IntegerType(), FloatType(), IntegerType()))
+        self.assertNotEqual(other, self.domain)
+        self.assertEqual(Domain((IntegerType(), object())).get_item_types()[0], IntegerType())
+
+    def test_slots(self):
+        entry = DataEntry(self.domain, self.raw[0])
+        for item in [entry, self.domain, Conjunction(self.domain, self.rules)] + self.rules:
+            self.assertFalse(hasattr(item, "__dict__"))
+
+
+class TestSplit(unittest.TestCase):
+    def test_stratified_split(self):
+        classes = [1] * 40 + [2] * 20 + [3]
+        train_rows, test_rows = stratified_split(classes, 0.25, random.Random(7))
+        self.assertEqual(sorted(list(train_rows) + list(test_rows)), range(len(classes)))
+        self.assertEqual(sorted(classes[row] for row in test_rows), [1] * 10 + [2] * 5)
+        self.assertEqual((train_rows, test_rows), stratified_split(classes, 0.25, random.Random(7)))
+        data_set = make_data_set(60)
+        random.seed(3)
+        expected = random.random()
+        random.seed(3)
+        split = RuleBuilder(data_set, seed=5).get_split()
+        self.assertEqual(random.random(), expected)
+        self.assertEqual(RuleBuilder(data_set, seed=5).get_split(), split)
+
+    def test_view(self):
+        data_set = make_data_set(20)
+        view = DataSetView(data_set, array("l", [3, 0, 7]))
+        self.assertIs(view.get_domain(), data_set.get_domain())
+        self.assertEqual(len(view), 3)
+        self.assertEqual(list(view), [data_set[3], data_set[0], data_set[7]])
+        self.assertEqual(view[1:], [data_set[0], data_set[7]])
+        self.assertEqual(view.get_column(1), [data_set[row].get_items()[1] for row in (3, 0, 7)])
+        self.assertEqual(view.get_classes(), [data_set[row].get_class() for row in (3, 0, 7)])
+
+def make_data_set(rows, seed=0):
+    rnd = random.Random(seed)
+    domain = Domain((CategoricalType("A", "B", "C"), IntegerType(), FloatType(), IntegerType()))
+    data_set = DataSet(domain)
+    for _ in range(rows):
+        category = rnd.choice("ABC")
+        number = rnd.randint(0, 40)
+        value = round(rnd.random() * 10, 1)
+        class_ = 1 if (category == "A" and number < 25) or value > 8 or rnd.random() < 0.1 else 2
+        data_set.append_raw([category, str(number), str(value), str(class_)])
+    return data_set
+
+
+def rules_as_strings(rules):
+    return sorted((sorted(str(conjunction).split(";")), round(informativity, 9))
+                  for conjunction, informativity in rules.items())
+
+
+class TestRuleBuilder(unittest.TestCase):
+    def test_workers_match_serial(self):
+        data_set = make_data_set(150)
+        builder = RuleBuilder(data_set, seed=1)
+        serial = builder.build_rules(class_=1, criterion_min=1)
+        parallel = builder.build_rules(class_=1, criterion_min=1, workers=2)
+        self.assertTrue(serial)
+        self.assertEqual(rules_as_strings(serial), rules_as_strings(parallel))
+        params = dict(class_=1, criterion_min=1, search="beam", beam_width=3, candidate_budget=20)
+        serial = builder.build_rules(**params)
+        parallel = builder.build_rules(workers=3, **params)
+        self.assertEqual(rules_as_strings(serial), rules_as_strings(parallel))
+
+    def test_bitset_counts_match_scan(self):
+        def scan(rows, conjunction):
+            N = sum(1 for row in rows if data_set[row].get_class() != 1)
+            covered = [data_set[row] for row in rows if conjunction.apply(data_set[row])]
+            p = sum(1 for entry in covered if entry.get_class() == 1)
+            return N, len(rows) - N, len(covered) - p, p
+
+        data_set = make_data_set(200, seed=7)
+        domain = data_set.get_domain()
+        builder = RuleBuilder(data_set, seed=8)
+        builder.build_rules(1, criterion_min=1)
+        count = builder._RuleBuilder__count
+        coverage = builder._RuleBuilder__conjunction_coverage
+        simple_rules = builder.get_simple_rules()
+        rnd = random.Random(9)
+        conjunctions = [Conjunction(domain, [rule]) for rule in simple_rules]
+        conjunctions += [Conjunction(domain, rnd.sample(simple_rules, rnd.randint(2, 3))) for _ in range(40)]
+        for rows, part in zip(builder.get_split(), (builder._RuleBuilder__train_part, builder._RuleBuilder__test_part)):
+            for conjunction in conjunctions:
+                self.assertEqual(count(coverage(conjunction), part), scan(rows, conjunction))
+
+    def test_build_rules_multi(self):
+        data_set = make_data_set(150)
+        builder = RuleBuilder(data_set, seed=2)
+        jobs = [(1, StatisticalCriterion(), dict(criterion_min=1)), (2, EntropyCriterion(), dict(criterion_min=0.01))]
+        expected = [builder.build_rules(class_, criterion=criterion, **params) for class_, criterion, params in jobs]
+        for workers in (1, 2):
+            results = builder.build_rules_multi(jobs, workers=workers)
+            self.assertEqual(map(rules_as_strings, expected), map(rules_as_strings, results))
+
+    def test_pruning_keeps_results(self):
+        def build(**params):
+            rules = builder.build_rules(checkpoint=path, **params)
+            with open(path, "rb") as f:
+                return rules, sorted(pickle.load(f)["rule_list"])
+
+        data_set = make_data_set(200, seed=3)
+        builder = RuleBuilder(data_set, seed=4)
+        directory = tempfile.mkdtemp()
+        path = os.path.join(directory, "state.ckpt")
+        try:
+            for criterion, criterion_min in ((StatisticalCriterion(), 2), (EntropyCriterion(), 0.05)):
+                params = dict(class_=1, criterion=criterion, criterion_min=criterion_min, search="beam", beam_width=20)
+                pruned, ranked = build(**params)
+                stats = builder.get_pruning_stats()
+                full, full_ranked = build(prune=False, **params)
+                self.assertTrue(any(len(rule_indices) > 1 for _, rule_indices in ranked))
+                self.assertEqual(ranked, full_ranked)
+                self.assertEqual(rules_as_strings(pruned), rules_as_strings(full))
+                self.assertGreater(stats["pruned"], 0)
+                self.assertGreater(builder.get_pruning_stats()["evaluated"], stats["evaluated"])
+        finally:
+            shutil.rmtree(directory)
+
+    def test_beam_search(self):
+        data_set = make_data_set(200, seed=5)
+        builder = RuleBuilder(data_set, seed=6)
+        rules = builder.build_rules(class_=1, criterion_min=1, search="beam", beam_width=3, candidate_budget=50)
+        self.assertTrue(rules)
+        self.assertLessEqual(builder.get_pruning_stats()["evaluated"], 3 * 51)
+        self.assertTrue(builder.build_rules(class_=1, criterion_min=1, search="beam", time_limit=0))
+        self.assertRaises(ValueError, builder.build_rules, class_=1, search="dfs")
+        self.assertRaises(ValueError, builder.build_rules, class_=1, beam_width=3)
+        self.assertRaises(ValueError, builder.build_rules, class_=1, candidate_budget=10)
+        self.assertRaises(ValueError, builder.build_rules, class_=1, search="beam", beam_width=0, candidate_budget=10)
+        self.assertRaises(ValueError, builder.build_rules, class_=1, search="beam", candidate_budget=0)
+        for search in ("exhaustive", "beam"):
+            for workers in (1, 2):
+                self.assertTrue(builder.build_rules(class_=1, criterion_min=1, search=search, workers=workers,
+                                                    time_limit=0))
+                self.assertEqual(builder.get_pruning_stats()["evaluated"], 0)
+
+    def test_boundary_thresholds(self):
+        domain = Domain((IntegerType(), IntegerType()))
+        data_set = DataSet(domain)
+        data_set.extend_raw([str(value), "1" if value <= 5 else "2"] for value in range(1, 11) for _ in range(4))
+        builder = RuleBuilder(data_set, seed=7, thresholds="boundary")
+        self.assertEqual(sorted(map(str, builder.get_simple_rules())), ["3:1:{5.5}", "4:1:{5.5}"])
+
+        data_set = make_data_set(200, seed=8)
+        builder = RuleBuilder(data_set, seed=9, thresholds="boundary", max_rules_per_feature=10)
+        rules = builder.get_simple_rules()
+        coverages = [rule.apply_batch(data_set) for rule in rules]
+        self.assertEqual(len(set(coverages)), len(rules))
+        for index in (1, 2):
+            self.assertLessEqual(len([rule for rule in rules if str(rule).split(":")[1] == str(index + 1)]), 10)
+
+    def test_deduplicate_coverage(self):
+        data_set = make_data_set(200, seed=10)
+        builder = RuleBuilder(data_set, seed=11)
+        params = dict(class_=1, criterion_min=1, search="beam", deduplicate_coverage=True)
+        rules = builder.build_rules(**params)
+        self.assertGreater(builder.get_pruning_stats()["duplicates"], 0)
+        coverages = [conjunction.apply_batch(data_set) for conjunction in rules]
+        self.assertEqual(len(set(coverages)), len(coverages))
+        self.assertEqual(rules_as_strings(rules), rules_as_strings(builder.build_rules(workers=2, **params)))
+
+    def test_resampled(self):
+        builder = RuleBuilder(make_data_set(300, seed=3), seed=4)
+        serial = builder.build_rules_resampled(1, repeats=4, seed=5, workers=1)
+        parallel = builder.build_rules_resampled(1, repeats=4, seed=5, workers=2)
+        as_strings = lambda rules: [(sorted(str(c).split(";")), s, round(i, 9)) for c, s, i in rules]
+        self.assertEqual(as_strings(serial), as_strings(parallel))
+        self.assertEqual([stability for _, stability, _ in serial],
+                         sorted([stability for _, stability, _ in serial], reverse=True))
+        for _, stability, _ in serial + builder.build_rules_resampled(1, folds=3, seed=5, workers=1):
+            self.assertTrue(0 < stability <= 1)
+
+    def test_append_rows(self):
+        full = make_data_set(400, seed=30)
+        domain = full.get_domain()
+        data_set, first, second = DataSet(domain), DataSet(domain), DataSet(domain)
+        data_set.extend(full[:300])
+        first.extend(full[300:350])
+        second.extend(full[350:])
+        instrumentation = Instrumentation()
+        builder = RuleBuilder(data_set, seed=31, observer=instrumentation)
+        self.assertIsNone(RuleBuilder(make_data_set(50), seed=1).append_rows(make_data_set(10)))
+        criterion = StatisticalCriterion()
+        rules = builder.build_rules(1, criterion=criterion, criterion_min=1)
+        updated = builder.append_rows(first, seed=32, tolerance=0.5)
+        self.assertNotIn("rebuilds", instrumentation.get_counters())
+        self.assertEqual(sorted(map(str, updated)), sorted(map(str, rules)))
+        _, test_rows = builder.get_split()
+        self.assertEqual(len(test_rows), len(set(test_rows)))
+        N = sum(1 for row in test_rows if data_set[row].get_class() != 1)
+        P = len(test_rows) - N
+        for conjunction, informativity in updated.items():
+            covered = [data_set[row] for row in test_rows if conjunction.apply(data_set[row])]
+            p = sum(1 for entry in covered if entry.get_class() == 1)
+            self.assertEqual(informativity, criterion.compute_from_counts(N, P, len(covered) - p, p))
+
+        builder.append_rows(second, seed=33, tolerance=-1.0)
+        self.assertEqual(instrumentation.get_counters()["rebuilds"], 1)
+        self.assertEqual(len(data_set), 400)
+        selectivity = builder.get_selectivity()
+        for rule in builder.get_simple_rules():
+            self.assertAlmostEqual(selectivity[rule], bin(rule.apply_batch(full)).count("1") / 400.0)
+        self.assertRaises(TypeError, builder.append_rows, DataSet(Domain((IntegerType(), IntegerType()))))
+
+    def test_instrumentation(self):
+        instrumentation = Instrumentation()
+        data_set = make_data_set(200, seed=12)
+        builder = RuleBuilder(data_set, seed=13, observer=instrumentation)
+        rules = builder.build_rules(1, criterion_min=1)
+        expected = RuleBuilder(data_set, seed=13).build_rules(1, criterion_min=1)
+        self.assertEqual(rules_as_strings(rules), rules_as_strings(expected))
+        timers = instrumentation.get_timers()
+        for stage in ("separate", "simple_rules", "initial_scoring", "rank_2", "stabilize", "reduce", "rule_list_insert"):
+            self.assertIn(stage, timers)
+        counters = instrumentation.get_counters()
+        self.assertEqual(counters["rule_applications"], len(builder.get_simple_rules()))
+        self.assertEqual(counters["rank_2_candidates"], builder.get_pruning_stats()["evaluated"] -
+                         sum(counters.get("rank_{0}_candidates".format(rank), 0) for rank in (3, 4)))
+        self.assertGreater(counters["rule_list_evictions"], 0)
+        self.assertGreaterEqual(counters["criterion_evaluations"], counters["error_scans"])
+        baseline = {"1000": {"total": 1.0, "stages": dict(timers, rank_2=0.001)}}
+        results = {"1000": {"total": 2.0, "stages": timers}}
+        self.assertEqual([stage for _, stage, _, _ in compare(results, baseline, 0.5)], ["total"])
+
+
+class Interrupted(Exception):
+    pass
+
+
+class InterruptingObserver(Instrumentation):
+    def __init__(self, stage=None, evaluations=None):
+        super(InterruptingObserver, self).__init__()
+        self.stage = stage
+        self.evaluations = evaluations
+
+    def on_stage(self, name, seconds):
+        if name == self.stage:
+            raise Interrupted()
+
+    def on_count(self, name, value):
+        super(InterruptingObserver, self).on_count(name, value)
+        if name == "criterion_evaluations" and self.get_counters()[name] == self.evaluations:
+            raise Interrupted()
+
+
+class TestCheckpoint(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "state.ckpt")
+        self.data_set = make_data_set(150, seed=20)
+        self.params = dict(class_=1, criterion_min=1, population=5, search="beam", candidate_budget=200,
+                           deduplicate_coverage=True)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def resume(self, observer):
+        builder = RuleBuilder(self.data_set, seed=21, observer=observer)
+        self.assertRaises(Interrupted, builder.build_rules, checkpoint=self.path, **self.params)
+        return RuleBuilder(self.data_set, seed=22).build_rules(resume_from=self.path, **self.params)
+
+    def test_resume(self):
+        instrumentation = Instrumentation()
+        expected = RuleBuilder(self.data_set, seed=21, observer=instrumentation).build_rules(**self.params)
+        evaluations = instrumentation.get_counters()["criterion_evaluations"]
+        self.assertEqual(rules_as_strings(self.resume(InterruptingObserver(stage="rank_3"))), rules_as_strings(expected))
+        with open(self.path, "rb") as f:
+            state = pickle.load(f)
+        self.assertEqual(state["stage"], "rank")
+        self.assertTrue(state["coverage_index"])
+        for key, rule_indices in state["coverage_index"].items():
+            self.assertIsInstance(key, int)
+            self.assertIsInstance(rule_indices, tuple)
+        self.assertEqual(rules_as_strings(self.resume(InterruptingObserver(evaluations=evaluations - 3))),
+                         rules_as_strings(expected))
+        with open(self.path, "rb") as f:
+            state = pickle.load(f)
+        self.assertEqual(state["stage"], "final")
+        self.assertIsNone(state["coverage_index"])
+        self.assertGreater(state["position"], 0)
+
+    def test_signature_mismatch(self):
+        RuleBuilder(self.data_set, seed=21).build_rules(checkpoint=self.path, **self.params)
+        builder = RuleBuilder(self.data_set, seed=21)
+        self.assertRaises(ValueError, builder.build_rules, resume_from=self.path, **dict(self.params, population=6))
+
+
+class TestDataCache(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "data.txt")
+        self.domain = Domain((CategoricalType("A", "B", "C"), IntegerType(), FloatType(), CategoricalType("X", "Y")))
+        self.write(["A 1 0.5 X", "C 7 2.5 Y", "B 3 1.0 X"])
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, lines):
+        with open(self.path, "w") as f:
+            f.write("\n".join(lines) + "\n")
+
+    def assertSameRows(self, data_set, rows):
+        self.assertEqual([list(entry.get_items()) + [entry.get_class()] for entry in data_set], rows)
+
+    def test_cache_round_trip(self):
+        rows = [["A", 1, 0.5, "X"], ["C", 7, 2.5, "Y"], ["B", 3, 1.0, "X"]]
+        self.assertSameRows(load_data_set(self.path, self.domain), rows)
+        cached = read_cache(self.path + ".cache", self.domain)
+        self.assertSameRows(cached, rows)
+        self.assertSameRows(load_data_set(self.path, self.domain), rows)
+        self.assertIsNone(read_cache(self.path + ".cache", Domain((IntegerType(), IntegerType()))))
+
+    def test_rebuild_on_change(self):
+        load_data_set(self.path, self.domain)
+        self.write(["B 2 0.5 Y"])
+        self.assertSameRows(load_data_set(self.path, self.domain), [["B", 2, 0.5, "Y"]])
+
+    def test_rebuild_on_corruption(self):
+        rows = [["A", 1, 0.5, "X"], ["C", 7, 2.5, "Y"], ["B", 3, 1.0, "X"]]
+        cache_path = self.path + ".cache"
+        load_data_set(self.path, self.domain)
+        with open(os.path.join(cache_path, "column_001.bin"), "ab") as f:
+            f.write("\0")
+        self.assertIsNone(read_cache(cache_path, self.domain))
+        self.assertSameRows(load_data_set(self.path, self.domain), rows)
+        with open(os.path.join(cache_path, "header.json")) as f:
+            header = json.load(f)
+        header["labels"] = ["X", "Z"]
+        self.assertIsNone(read_cache(cache_path, self.domain, header))
+        header["labels"] = header["labels"][:1]
+        self.assertIsNone(read_cache(cache_path, self.domain, header))
+        with open(os.path.join(cache_path, "column_000.bin"), "r+b") as f:
+            f.write("\xff")
+        self.assertIsNone(read_cache(cache_path, self.domain))
+        self.assertSameRows(load_data_set(self.path, self.domain), rows)
+        os.remove(os.path.join(cache_path, "classes.bin"))
+        self.assertSameRows(load_data_set(self.path, self.domain), rows)
+
+
+class TestRuleScorer(unittest.TestCase):
+    def setUp(self):
+        self.data_set = make_data_set(150)
+        self.domain = self.data_set.get_domain()
+        rule_builder = RuleBuilder(self.data_set, seed=1)
+        self.lines = ["{0};{1};{2}".format(class_, conjunction, informativity)
+                      for class_ in (1, 2)
+                      for conjunction, informativity in rule_builder.build_rules(class_, population=5).items()]
+
+    def test_parse(self):
+        for line in self.lines:
+            class_, conjunction, informativity = parse_rule_line(self.domain, line)
+            self.assertEqual("{0};{1};{2}".format(class_, conjunction, informativity), line)
+        self.assertEqual(str(parse_rule(self.domain, "5:2:{3,7.5}")), "5:2:{3,7.5}")
+        self.assertRaises(ValueError, parse_rule, self.domain, "7:1:{A}")
+        self.assertRaises(ValueError, parse_rule_line, self.domain, "1;2.0")
+
+    def test_scoring(self):
+        scorer = RuleScorer(self.domain, [parse_rule_line(self.domain, line) for line in self.lines])
+        votes = scorer.score_batch(self.data_set)
+        for row, entry in enumerate(self.data_set):
+            expected = scorer.score_entry(entry)
+            for class_ in scorer.get_classes():
+                self.assertAlmostEqual(votes[class_][row], expected[class_])
+        records = [list(map(str, entry.get_items())) for entry in self.data_set]
+        streamed = list(scorer.score_stream(records, chunk_size=40))
+        self.assertEqual(len(streamed), len(self.data_set))
+        for row, scores in enumerate(streamed):
+            for class_ in scorer.get_classes():
+                self.assertAlmostEqual(scores[class_], votes[class_][row])
+        self.assertEqual(list(scorer.classify_stream(records, chunk_size=40)), scorer.classify_batch(self.data_set))
+        self.assertEqual(scorer.benchmark(records, repeat=1)["records"], len(records))
+
+
 if __name__ == "__main__":
     unittest.main()